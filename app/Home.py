@@ -6,6 +6,7 @@ from pathlib import Path
 
 import streamlit as st
 
+from utilities.data_store import get_data_store
 from utilities.load_assets import load_css
 
 from components.command_palette import mount_command_palette
@@ -40,6 +41,13 @@ Data interface for exploring earnings report filings and financial tables.
     st.page_link("pages/MultiYearFinancials.py", label="Multi-Year Financials", icon="📈")
     st.caption("Cross-company, multi-year comparisons.")
 
+    with st.expander("Data cache"):
+        st.caption("Data files loaded by this server process, reloaded when the pipeline rewrites them.")
+        store = get_data_store()
+        st.dataframe(store.stats(), hide_index=True)
+        st.caption("Tables derived from them, least recently used first out.")
+        st.dataframe([store.tables.stats()], hide_index=True)
+
 
 def build_pages() -> dict[str, list[st.Page]]:
     pages: dict[str, list[st.Page]] = {"": [], "Data Sheets": []}
@@ -1,6 +1,5 @@
 # resuable components
 import streamlit as st
-import polars as pl
 import altair as alt
 
 import math
@@ -15,36 +14,26 @@ class ColumnControls:
 
         self.value = None
 
-    def render(self, column_values, *, chart_key=None):
+    def render(self, bins, extent, *, chart_key=None):
+        """ histogram with a brush, from the column's bins (x1, x2, count) and extent (min, max)
 
-        if column_values.height > 0:
-            chart_data = column_values.to_pandas()
+        Both come from the pipeline's distributions.parquet (postprocessing.write_distributions);
+        None when it has no values of the column.
+        """
+
+        if bins is not None and bins.height > 0:
             selected_interval = alt.selection_interval('interval')
 
             # Symlog histogram: Vega-Lite cannot reliably combine bin + symlog on one
-            # field (bars often do not render). Bin in symlog space, map edges back to
-            # the original scale, then draw interval bars.
-            v = chart_data["value"]
-            vmin, vmax = float(v.min()), float(v.max())
+            # field (bars often do not render). The bins are computed by the pipeline
+            # in symlog space, with edges mapped back to the original scale; only the
+            # bars are sent to the browser.
+            vmin, vmax = map(float, extent)
             x_domain = axis_domain_symlog(vmin, vmax)
             x_ticks = axis_ticks_symlog(vmin, vmax)
             x_tick_labels = list(tick_labels(x_ticks))
-            symlog_sign = "(datum.value >= 0 ? 1 : -1)"
-            symlog_x = f"{symlog_sign} * log(1 + abs(datum.value))/log(10)"
-            bin_sign = "(datum.bin_symlog_x >= 0 ? 1 : -1)"
-            bin_end_sign = "(datum.bin_symlog_x_end >= 0 ? 1 : -1)"
             histogram = (
-                alt.Chart(chart_data)
-                .transform_calculate(symlog_x=symlog_x)
-                .transform_bin(
-                    bin=alt.Bin(maxbins=150),
-                    field="symlog_x",
-                    as_="bin_symlog_x",
-                )
-                .transform_calculate(
-                    x1=f"{bin_sign} * (pow(10, abs(datum.bin_symlog_x)) - 1)",
-                    x2=f"{bin_end_sign} * (pow(10, abs(datum.bin_symlog_x_end)) - 1)",
-                )
+                alt.Chart(bins.to_pandas())
                 .mark_bar()
                 .encode(
                     x=alt.X(
@@ -67,7 +56,7 @@ class ColumnControls:
                         ),
                     ),
                     x2=alt.X2("x2:Q"),
-                    y=alt.Y("count():Q", title=None, axis=alt.Axis(labels=False)),
+                    y=alt.Y("count:Q", title=None, axis=alt.Axis(labels=False)),
                 )
             )
 
@@ -100,13 +89,6 @@ class ColumnControls:
         else:
             st.info(f"No data available for {self.column_name}.")
 
-    def get_filter_expression(self):
-        """ polars expression capturing the filter criteria """
-        if self.range is None:
-            return True
-        else:
-            return pl.col(self.column_name).is_between(*self.range)
-
     def get_column_formatting(self):
         """Display formatting for the corresponding column"""
         return st.column_config.NumberColumn(format=f"compact")
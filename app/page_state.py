@@ -126,12 +126,6 @@ class DataSelections:
         self.selected_columns: list[str] = list(self.DEFAULT_SELECTED_COLUMNS)
         self.selected_ciks: set[int] = set()
 
-    def cik_filter_expression(self) -> pl.Expr | bool:
-        """Polars filter keeping only selected CIKs; no-op when none are selected."""
-        if not self.selected_ciks:
-            return False
-        return pl.col("cik").is_in(list(self.selected_ciks))
-
     def with_select_column(
         self, frame: pl.DataFrame, columns: list[str]
     ) -> pl.DataFrame:
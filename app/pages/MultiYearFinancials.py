@@ -2,16 +2,19 @@ from __future__ import annotations
 
 import json
 import math
+from functools import lru_cache
 
 from typing import TYPE_CHECKING
 
 import altair as alt
+import numpy as np
 import polars as pl
 import streamlit as st
 from humanize import scientific
 
 from components.controls import symexp, symlog
 from page_state import get_data_selection
+from utilities.data_store import get_data_store
 
 if TYPE_CHECKING:
     import pandas as pd
@@ -47,6 +50,8 @@ def scientific_axis(ticks: list[float]) -> alt.Axis:
     )
 
 
+# pure in the data extent, which stays the same over reruns with the same selections
+@lru_cache(maxsize=1024)
 def _linear_ticks_for_domain(
     data_min: float, data_max: float, *, count: int = 5
 ) -> tuple[tuple[float, float], list[float]]:
@@ -79,6 +84,7 @@ def _linear_ticks_for_domain(
     return (lo, hi), ticks
 
 
+@lru_cache(maxsize=1024)
 def _symlog_ticks_for_domain(
     data_min: float, data_max: float
 ) -> tuple[tuple[float, float], list[float]]:
@@ -126,12 +132,12 @@ def _symlog_ticks_for_domain(
 
 def value_y_encoding(chart_data: pd.DataFrame, *, log_scale: bool = False) -> alt.Y:
     """Build Altair y-encoding with data-driven linear or symlog scale."""
-    values = chart_data["value"].dropna()
-    values = values[values.map(math.isfinite)]
-    if values.empty:
+    values = chart_data["value"].to_numpy(dtype=float)
+    values = values[np.isfinite(values)]
+    if values.size == 0:
         raise ValueError("No finite values to chart.")
 
-    data_min, data_max = values.min(), values.max()
+    data_min, data_max = float(values.min()), float(values.max())
 
     if log_scale:
         domain, ticks = _symlog_ticks_for_domain(data_min, data_max)
@@ -150,7 +156,7 @@ def value_y_encoding(chart_data: pd.DataFrame, *, log_scale: bool = False) -> al
         "value:Q",
         title="Value",
         scale=scale,
-        axis=scientific_axis(ticks),
+        axis=scientific_axis(list(ticks)),
     )
 
 
@@ -181,7 +187,10 @@ def render_concept_chart(
 
 # --- page render ---
 
-full_data = pl.read_parquet("data/sheets.parquet")
+# facts carry the cik only; names and tickers are joined from the companies table
+store = get_data_store()
+full_data = store.facts()
+companies = store.companies()
 data_selection = get_data_selection()
 selected_columns = data_selection.selected_columns
 selected_ciks = data_selection.selected_ciks
@@ -204,9 +213,12 @@ st.caption(
     "(from Yearly Financials selections)"
 )
 
-filtered = full_data.filter(
-    pl.col("label").is_in(selected_columns),
-    pl.col("cik").is_in(list(selected_ciks)),
+filtered = (
+    full_data.filter(
+        pl.col("label").is_in(selected_columns),
+        pl.col("cik").is_in(list(selected_ciks)),
+    )
+    .join(companies, on="cik", how="left")
 )
 
 if filtered.height == 0:
@@ -1,8 +1,8 @@
 import streamlit as st
-import polars as pl
 
-metadata = pl.read_parquet("data/metadata.parquet")
-labels = metadata["label"].to_list()
+from utilities.data_store import get_data_store
+
+labels = get_data_store().labels()
 
 
 st.title("Smart Columns")
@@ -1,9 +1,14 @@
+import time
+
 import streamlit as st
 import polars as pl
 
 from components.controls import ColumnControls
+from distributions import value_distributions  # from data/, on PYTHONPATH as in the readme
 from page_state import get_data_selection
 from utilities.company_search import sort_by_company_relevance
+from utilities.data_store import COMPANIES, DISTRIBUTIONS, get_data_store, wide_table
+from utilities.filter_masks import FilterMasks
 
 # layout
 MIN_TABLE_HEIGHT = 600
@@ -12,10 +17,83 @@ DEFAULT_SIDEBAR_WIDTH = 0.22
 MIN_SIDEBAR_WIDTH = 0.15
 MAX_SIDEBAR_WIDTH = 0.45
 
-# data set up
-full_data = pl.read_parquet("data/sheets.parquet")
-metadata = pl.read_parquet("data/metadata.parquet")
-labels = metadata['label']
+# data set up: one wide cik x label table per year, see postprocessing.write_wide_tables
+INDEX_COLUMNS = ["cik", "company", "tickers"]
+
+store = get_data_store()
+labels = store.labels()
+
+
+def load_year(year: int, columns: list[str]) -> pl.DataFrame:
+    """Companies reporting any of *columns* in *year*, columns the year lacks are null.
+
+    One lazy query over the year's table: the column selection and the
+    not-null filter are pushed into the parquet scan, so only those columns
+    are decoded and row groups without any of them are skipped.
+    """
+    wide = store.wide(year)
+    stored = wide.collect_schema() if wide is not None else {}
+    present = [col for col in columns if col in stored]
+    if not present:
+        return pl.DataFrame(schema={
+            "cik": pl.UInt32, "company": pl.String, "tickers": pl.String,
+            **{col: pl.Float64 for col in columns},
+        })
+    # NaN marks a fact reported without a value: the company is listed, with an empty cell
+    return (
+        wide.select("cik", *present)
+        .filter(pl.any_horizontal(pl.col(present).is_not_null()))
+        .with_columns(pl.col(present).fill_nan(None))
+        .join(store.companies().lazy(), on="cik", how="left", maintain_order="left")
+        .with_columns(pl.lit(None, dtype=pl.Float64).alias(col) for col in columns if col not in present)
+        .select(*INDEX_COLUMNS, *columns)
+        .collect()
+    )
+
+
+def cached_year(year: int, columns: list[str], key: tuple) -> pl.DataFrame:
+    """load_year through the store's table cache, shared by all sessions; *key* is year_key(year, columns).
+
+    Widget interactions that keep the year and columns (brushes, search,
+    selections) only filter the cached frame.
+    """
+    return store.tables.get(key, lambda: load_year(year, columns)).select(*INDEX_COLUMNS, *columns)
+
+
+def year_key(year: int, columns: list[str]) -> tuple:
+    """Identifies the rows of cached_year(year, columns), in order."""
+    return (
+        store.version(wide_table(year)), store.version(COMPANIES),
+        year, frozenset(columns),
+    )
+
+
+def live_distribution(column: str, values: pl.Series) -> pl.DataFrame:
+    """Statistics row of *column* as postprocessing.write_distributions computes it, from *values*."""
+    finite = values.filter(values.is_finite())
+    if finite.is_empty():
+        return pl.DataFrame()
+    return value_distributions(pl.DataFrame({"label": column, "value": finite}), ["label"])
+
+
+def column_histogram(
+    year: int, column: str, values: pl.Series
+) -> tuple[pl.DataFrame | None, tuple[float, float] | None]:
+    """Histogram bins and extent of *column* in *year*.
+
+    Read from the pipeline's distributions.parquet; without it, computed from
+    the loaded *values* of the column and kept in the store's table cache.
+    """
+    if store.version(DISTRIBUTIONS) is not None:
+        distribution = store.distribution(column, year)
+    else:
+        key = ("distribution", store.version(wide_table(year)), year, column)
+        distribution = store.tables.get(key, lambda: live_distribution(column, values))
+    if distribution is None or distribution.is_empty():
+        return None, None
+    extent = distribution["min"].item(), distribution["max"].item()
+    return distribution["bins"].explode().struct.unnest(), extent
+
 
 st.title("Yearly Financials")
 
@@ -45,9 +123,6 @@ with main_col:
     years = list(range(1994, 2027))[::-1]
     selected_year = st.selectbox("Select Year", years, index=1)
 
-    # selecting the data we need
-    full_data = full_data.filter(pl.col('fiscal_year') == selected_year)
-
     data_selection = get_data_selection()
     columns = st.multiselect(
         "Select Columns",
@@ -65,7 +140,11 @@ with main_col:
 
     column_controls = {col: ColumnControls(col) for col in columns}
 
-    full_data = full_data.filter(pl.col('label').is_in(columns))
+    # selecting the data we need
+    read_start = time.perf_counter()
+    year_data_key = year_key(selected_year, columns)
+    year_data = cached_year(selected_year, columns, year_data_key)
+    read_ms = (time.perf_counter() - read_start) * 1000
 
 table_height = max(MIN_TABLE_HEIGHT, len(columns) * SIDEBAR_ITEM_HEIGHT)
 
@@ -102,15 +181,18 @@ if sidebar_col is not None:
                     st.session_state["yearly_financials_sidebar_collapsed"] = True
                     st.rerun()
 
+            if columns and store.version(DISTRIBUTIONS) is None:
+                st.caption("Histograms computed from the loaded data: run the postprocessing to precompute them.")
+
             for i, column in enumerate(columns):
                 if i > 0:
                     st.divider()
                 st.write(f'__{column}__')
-                col_df = full_data.filter(pl.col('label') == column)
-
+                bins, extent = column_histogram(selected_year, column, year_data[column])
                 current_settings = column_controls[column]
                 current_settings.render(
-                    col_df,
+                    bins,
+                    extent,
                     chart_key=f"filter_{column}_{filter_reset_nonce}",
                 )
 
@@ -118,18 +200,17 @@ if sidebar_col is not None:
 with main_col:
     data_selection = get_data_selection()
 
-    # apply filters from the sidebar selectors
-    to_show = full_data.pivot(on='label', values='value', index=['cik', 'company', 'tickers'])
-    # columns can be missing from individual years, fill those with nans
-    to_show = to_show.with_columns([pl.lit(None).alias(col) for col in columns
-                                    if col not in to_show.columns])
-
-    filter_in_selected = data_selection.cik_filter_expression()
-
-    for settings in column_controls.values():
-        to_show = to_show.filter(settings.get_filter_expression() | filter_in_selected)
+    # apply filters from the sidebar selectors, selected companies always shown
+    filter_masks = st.session_state.setdefault("yearly_financials_filter_masks", FilterMasks())
+    shown_rows = filter_masks.rows(
+        year_data_key,
+        year_data,
+        {column: settings.range for column, settings in column_controls.items()},
+        keep_ciks=data_selection.selected_ciks,
+    )
+    to_show = year_data[shown_rows]
 
-    to_show = sort_by_company_relevance(to_show, company_query)
+    to_show = sort_by_company_relevance(to_show, company_query, index=store.search_index())
 
     # ensure that selections are displayed as selected
     display_df = data_selection.with_select_column(to_show, columns)
@@ -150,5 +231,12 @@ with main_col:
         },
     )
 
+    table_cache = store.tables.stats()
+    st.caption(
+        f"Read {year_data.height:,} companies × {len(columns)} columns for {selected_year} "
+        f"in {read_ms:.0f} ms · table cache: {table_cache['hit_rate']:.0%} hits, "
+        f"{table_cache['megabytes']:.1f} MB"
+    )
+
     if data_selection.sync_from_editor(edited_df):
         st.rerun()
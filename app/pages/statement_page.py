@@ -4,34 +4,44 @@ import re
 from collections.abc import Callable
 
 import streamlit as st
-from edgar import set_identity, Company, find
+from edgar import set_identity, Company
 
+import edgar_cache  # from data/, on PYTHONPATH as in the readme
 from page_state import OpenSheets
+from utilities.data_store import get_data_store
 from utilities.parsed_command import ParsedCommand, display_name_from_parsed, identity_label
 from utilities.renderers import render_rich
 
 set_identity("Your Name yourname@domain.com")
 
+# one on-disk cache per process, shared by every session
+EDGAR_CACHE = edgar_cache.EdgarCache()
+
 
 def load_statement(parsed: ParsedCommand):
-    """Fetch filing statement data from Edgar."""
+    """Fetch filing statement data from Edgar, through the local response cache."""
     ticker_name = parsed["ticker_name"]
     company_name = parsed["company_name"]
     year = parsed["year"]
     statement_name = parsed["statement_name"]
 
     if ticker_name and not company_name:
-        company = Company(ticker_name)
+        # resolved locally through the ticker index written by the pipeline
+        ciks = get_data_store().ciks_by_ticker().get(ticker_name.upper())
+        company = Company(ciks[0] if ciks else ticker_name)
     elif not ticker_name:
-        company = find(company_name)[0]
+        company = edgar_cache.find(company_name, EDGAR_CACHE)[0]
     else:
-        company = find(f"{ticker_name} - {company_name}")[0]
+        company = edgar_cache.find(f"{ticker_name} - {company_name}", EDGAR_CACHE)[0]
 
-    filing = company.get_filings(form="10-K", year=year, amendments=False).latest()
+    filings = edgar_cache.get_filings(
+        company, EDGAR_CACHE, form="10-K", year=year, amendments=False
+    )
+    filing = filings.latest() if filings is not None else None
     if filing is None:
         return "Statement not found."
 
-    xbrl = filing.xbrl()
+    xbrl = edgar_cache.filing_xbrl(filing, EDGAR_CACHE)
     if xbrl is None:
         return "Statement not found."
 
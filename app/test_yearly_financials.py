@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import polars as pl
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import postprocessing
+from page_state import DataSelections
+
+PAGE = Path(__file__).parent / "pages" / "YearlyFinancials.py"
+YEAR = 2014
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch, fetched):
+    """A data directory written by the pipeline, the app run from its parent as from the repo root."""
+    data = tmp_path / "data"
+    data.mkdir()
+    monkeypatch.chdir(data)
+    fetched().to_parquet("fetched.parquet")
+    postprocessing.postprocess()
+    monkeypatch.chdir(tmp_path)
+    st.cache_resource.clear()
+    yield data
+    st.cache_resource.clear()
+
+
+def run_page(columns: list[str]) -> AppTest:
+    at = AppTest.from_file(str(PAGE), default_timeout=60)
+    selection = DataSelections()
+    selection.selected_columns = columns
+    at.session_state["data_selection"] = selection
+    at.run()
+    at.selectbox[0].set_value(YEAR).run()
+    assert not at.exception, at.exception
+    return at
+
+
+def histograms(at: AppTest) -> list[bytes]:
+    """The filter panels' charts, with their data."""
+    return [chart.proto.SerializeToString(deterministic=True) for chart in at.get("vega_lite_chart")]
+
+
+def test_filters_without_distributions(data_dir):
+    columns = pl.read_parquet(data_dir / "metadata.parquet")["label"].drop_nulls().unique().sort().to_list()[:2]
+    with_sidecar = histograms(run_page(columns))
+
+    (data_dir / "distributions.parquet").unlink()
+    st.cache_resource.clear()
+    at = run_page(columns)
+
+    assert not [info.value for info in at.info if "No data available" in info.value]
+    assert any("postprocessing" in caption.value for caption in at.caption)
+    assert len(with_sidecar) == len(columns)
+    assert histograms(at) == with_sidecar
+
+
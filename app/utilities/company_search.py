@@ -2,58 +2,129 @@
 
 from __future__ import annotations
 
+from functools import lru_cache
+
+import numpy as np
 import polars as pl
-from rapidfuzz import fuzz, utils
+from rapidfuzz import fuzz, process, utils
 
 _PROCESSOR = utils.default_process
 
+# scores of the last queries typed, e.g. every prefix of a company name
+QUERY_CACHE_SIZE = 256
 
-def _ticker_relevance(query: str, tickers: str | None) -> float:
-    if not tickers:
-        return 0.0
-    processed_query = _PROCESSOR(query)
-    return max(
-        (
-            fuzz.ratio(processed_query, _PROCESSOR(ticker))
-            for ticker in tickers.split(",")
-            if ticker.strip()
-        ),
-        default=0.0,
-    )
 
+class CompanySearchIndex:
+    """Company names and tickers, pre-processed once, scored against a query in bulk.
+
+    A company's relevance is the best of the WRatio of its name and the
+    ratio of each of its tickers (comma separated in *tickers_col*).
+    Scores are cached per query.
+    """
+
+    def __init__(
+        self,
+        companies: pl.DataFrame,
+        *,
+        key_col: str = "cik",
+        company_col: str = "company",
+        tickers_col: str = "tickers",
+    ) -> None:
+        self.key_col = key_col
+        self.keys = companies[key_col]
+        self.names = [_PROCESSOR(name) if name else "" for name in companies[company_col].to_list()]
+
+        tickers = (
+            companies.select(
+                pl.int_range(pl.len(), dtype=pl.UInt32).alias("owner"),
+                pl.col(tickers_col).str.split(",").alias("ticker"),
+            )
+            .explode("ticker")
+            .filter(pl.col("ticker").str.strip_chars() != "")
+        )
+        self.tickers = [_PROCESSOR(ticker) for ticker in tickers["ticker"].to_list()]
+        self.ticker_owners = tickers["owner"].to_numpy()
+
+        self.scores = lru_cache(maxsize=QUERY_CACHE_SIZE)(self._scores)
 
-def _row_relevance(company: str, tickers: str | None, query: str) -> float:
-    company_score = fuzz.WRatio(query, company, processor=_PROCESSOR)
-    return max(company_score, _ticker_relevance(query, tickers))
+    def _scores(self, query: str) -> np.ndarray:
+        """Relevance of every company to *query*, in index order; call through `scores`."""
+        processed = _PROCESSOR(query)
+        scores = process.cdist(
+            [processed], self.names, scorer=fuzz.WRatio, dtype=np.float64, workers=-1
+        )[0]
+        ticker_scores = process.cdist(
+            [processed], self.tickers, scorer=fuzz.ratio, dtype=np.float64, workers=-1
+        )[0]
+        np.maximum.at(scores, self.ticker_owners, ticker_scores)
+        scores.setflags(write=False)
+        return scores
+
+    def relevance(self, frame: pl.DataFrame, query: str) -> pl.Series:
+        """Relevance of the rows of *frame* to *query*, by their key; 0 for keys not in the index."""
+        scores = pl.DataFrame({self.key_col: self.keys, "relevance": self.scores(query)})
+        return (
+            frame.select(self.key_col)
+            .join(scores, on=self.key_col, how="left", maintain_order="left")
+            .get_column("relevance")
+            .fill_null(0.0)
+        )
 
 
 def sort_by_company_relevance(
     frame: pl.DataFrame,
     query: str,
     *,
+    index: CompanySearchIndex | None = None,
+    top_k: int | None = None,
+    key_col: str = "cik",
     company_col: str = "company",
     tickers_col: str = "tickers",
 ) -> pl.DataFrame:
     """Return *frame* sorted by how well *company_col* matches *query*.
 
-    Non-matching rows are kept and appear after matches. An empty query
-    preserves the incoming row order.
+    Non-matching rows are kept and appear after matches, unless *top_k*
+    keeps only that many of the best rows. Ties keep the incoming order,
+    and an empty query preserves it. *index* should cover the keys of
+    *frame*; one is built from the frame when not given.
     """
     q = query.strip()
     if not q or frame.is_empty():
         return frame
 
-    relevance = (
-        pl.struct(company_col, tickers_col)
-        .map_elements(
-            lambda row: _row_relevance(row[company_col], row[tickers_col], q),
-            return_dtype=pl.Float64,
+    if index is None:
+        index = CompanySearchIndex(
+            frame.unique(key_col, maintain_order=True),
+            key_col=key_col, company_col=company_col, tickers_col=tickers_col,
         )
-        .alias("_company_relevance")
-    )
 
-    return (
-        frame.with_columns(relevance)
-        .sort("_company_relevance", descending=True)
+    ranked = (
+        frame.with_columns(index.relevance(frame, q).alias("_company_relevance"))
+        .sort("_company_relevance", descending=True, maintain_order=True)
         .drop("_company_relevance")
     )
+    return ranked if top_k is None else ranked.head(top_k)
+
+
+if __name__ == "__main__":
+    # per-keystroke latency over the full company universe, from the repository root:
+    #   PYTHONPATH=app python -m utilities.company_search "apple inc"
+    import sys
+    import time
+
+    companies = pl.read_parquet("data/companies.parquet")
+    query = sys.argv[1] if len(sys.argv) > 1 else "apple inc"
+    prefixes = [query[:end] for end in range(1, len(query) + 1)]
+
+    start = time.perf_counter()
+    index = CompanySearchIndex(companies)
+    print(f"{companies.height:,} companies, {len(index.tickers):,} tickers: "
+          f"index built in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    for run in ("typed", "typed again (cached)"):
+        latencies = []
+        for prefix in prefixes:
+            start = time.perf_counter()
+            sort_by_company_relevance(companies, prefix, index=index)
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"{run}: {np.mean(latencies):.1f} ms per keystroke, max {np.max(latencies):.1f} ms")
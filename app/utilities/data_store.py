@@ -0,0 +1,230 @@
+"""Process-wide cache of the data files written by the pipeline."""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TypeVar
+
+import polars as pl
+import streamlit as st
+
+from utilities.company_search import CompanySearchIndex
+from utilities.frame_cache import FrameCache
+from utilities.memory_map import read_mapped
+
+T = TypeVar("T")
+
+DATA_DIR = Path("data")
+SHEETS = "sheets.arrow"
+METADATA = "metadata.parquet"
+COMPANIES = "companies.parquet"
+DISTRIBUTIONS = "distributions.parquet"
+TICKER_INDEX = "ticker_index.parquet"
+WIDE_TABLES = "wide"
+
+# what the pages use of the sheets
+FACT_COLUMNS = ["cik", "fiscal_year", "label", "value"]
+
+# larger files are memory-mapped: mapping them again is cheaper than hashing them
+HASH_LIMIT = 64 * 2**20
+
+# derived per-page tables, see DataStore.tables
+TABLE_CACHE_BYTES = 256 * 2**20
+
+
+@dataclass
+class FileStats:
+    hits: int = 0
+    misses: int = 0
+    invalidations: int = 0
+    unchanged_rewrites: int = 0
+    load_seconds: float = 0.0
+
+
+@dataclass
+class _CachedFile:
+    fingerprint: tuple[int, int, int]
+    digest: str | None = None
+    generation: int = 0
+    values: dict[Hashable, object] = field(default_factory=dict)
+
+
+def _index_distributions(path: Path) -> tuple[pl.DataFrame, dict[tuple[int, str], int]]:
+    frame = pl.read_parquet(path)
+    keys = zip(frame["fiscal_year"].to_list(), frame["label"].to_list())
+    return frame, {key: row for row, key in enumerate(keys)}
+
+
+def _ciks_by_ticker(path: Path) -> dict[str, list[int]]:
+    index = pl.read_parquet(path).explode("tickers").drop_nulls("tickers")
+    grouped = index.group_by("tickers", maintain_order=True).agg("cik")
+    return dict(zip(grouped["tickers"].to_list(), grouped["cik"].to_list()))
+
+
+def wide_table(year: int) -> str:
+    return f"{WIDE_TABLES}/{year}.parquet"
+
+
+def _fingerprint(path: Path) -> tuple[int, int, int]:
+    stat = path.stat()
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _digest(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class DataStore:
+    """Loads what the pages read from each data file once per process.
+
+    Every access checks the file's inode, mtime and size. When those change
+    (the pipeline ran), the new content is hashed: cached values are dropped
+    only if it differs from the content they were loaded from. The first load
+    of a file is not hashed, so an unchanged rewrite is only recognised from
+    the second one on. Files over HASH_LIMIT are reloaded on any change.
+
+    Frames the pages derive from the files go in *tables*, a bounded LRU keyed
+    on the version() of the files they were built from.
+    """
+
+    def __init__(self, data_dir: str | Path = DATA_DIR, table_bytes: int = TABLE_CACHE_BYTES) -> None:
+        self.data_dir = Path(data_dir)
+        self.tables = FrameCache(table_bytes)
+        self._files: dict[str, _CachedFile] = {}
+        self._stats: dict[str, FileStats] = {}
+        self._lock = threading.Lock()
+        self._loading: dict[tuple[str, Hashable], threading.Lock] = {}
+
+    def _validate(self, name: str) -> _CachedFile:
+        """Cache entry of *name*, emptied if the file's content changed; call with the lock held."""
+        path = self.data_dir / name
+        fingerprint = _fingerprint(path)
+        stats = self._stats.setdefault(name, FileStats())
+        cached = self._files.get(name)
+        if cached is None:
+            cached = self._files[name] = _CachedFile(fingerprint)
+        elif cached.fingerprint != fingerprint:
+            digest = _digest(path) if fingerprint[2] <= HASH_LIMIT else None
+            if digest is not None and digest == cached.digest:
+                stats.unchanged_rewrites += 1
+                cached.fingerprint = fingerprint
+            else:
+                stats.invalidations += 1
+                cached = self._files[name] = _CachedFile(fingerprint, digest, cached.generation + 1)
+        return cached
+
+    def version(self, name: str) -> int | None:
+        """Number of content changes of the file *name* seen by this store, None if it does not exist."""
+        if not (self.data_dir / name).exists():
+            return None
+        with self._lock:
+            return self._validate(name).generation
+
+    def _cached(self, name: str, key: Hashable, load: Callable[[Path], T]) -> T:
+        """Value of *key* for the file *name*, from `load(path)` on a miss.
+
+        Loads run outside the store-wide lock, under one lock per (name, key):
+        concurrent misses of a key load it once, other keys are not held up.
+        """
+        path = self.data_dir / name
+        with self._lock:
+            cached = self._validate(name)
+            if key in cached.values:
+                self._stats[name].hits += 1
+                return cached.values[key]
+            key_lock = self._loading.setdefault((name, key), threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                cached = self._validate(name)
+                stats = self._stats[name]
+                if key in cached.values:
+                    stats.hits += 1
+                    return cached.values[key]
+
+            start = time.perf_counter()
+            value = load(path)
+            elapsed = time.perf_counter() - start
+
+            # into the entry validated before the load: if the file changed since,
+            # that entry is already replaced and the next access loads again
+            with self._lock:
+                cached.values[key] = value
+                stats.load_seconds += elapsed
+                stats.misses += 1
+            return value
+
+    def sheets(self, columns: list[str] | None = None) -> pl.DataFrame:
+        """Facts in long format, memory-mapped; *columns* selects a projection."""
+        key = None if columns is None else tuple(columns)
+        return self._cached(SHEETS, ("sheets", key), lambda path: read_mapped(path, columns))
+
+    def facts(self) -> pl.DataFrame:
+        """The (cik, fiscal_year, label, value) projection of the sheets."""
+        return self.sheets(FACT_COLUMNS)
+
+    def metadata(self) -> pl.DataFrame:
+        return self._cached(METADATA, "metadata", pl.read_parquet)
+
+    def labels(self) -> list[str]:
+        """Labels of the common concepts, most frequently reported first."""
+        return self._cached(METADATA, "labels", lambda path: pl.read_parquet(path)["label"].to_list())
+
+    def companies(self) -> pl.DataFrame:
+        """The cik -> company, tickers table the facts are joined with."""
+        return self._cached(COMPANIES, "companies", pl.read_parquet)
+
+    def search_index(self) -> CompanySearchIndex:
+        """Search index over the companies, with its query cache."""
+        return self._cached(COMPANIES, "search_index", lambda path: CompanySearchIndex(pl.read_parquet(path)))
+
+    def ciks_by_ticker(self) -> dict[str, list[int]]:
+        """Ticker -> CIKs, from the pipeline's ticker index; empty when there is none.
+
+        Reassigned tickers can belong to more than one company, listed in the
+        order of edgar's reference table.
+        """
+        if not (self.data_dir / TICKER_INDEX).exists():
+            return {}
+        return self._cached(TICKER_INDEX, "ciks_by_ticker", _ciks_by_ticker)
+
+    def distribution(self, label: str, year: int) -> pl.DataFrame | None:
+        """Statistics row of *label* in *year*, see postprocessing.write_distributions.
+
+        None when there is no such row, or no distributions.parquet.
+        """
+        if not (self.data_dir / DISTRIBUTIONS).exists():
+            return None
+        frame, index = self._cached(DISTRIBUTIONS, "indexed", _index_distributions)
+        row = index.get((year, label))
+        return None if row is None else frame.slice(row, 1)
+
+    def wide(self, year: int) -> pl.LazyFrame | None:
+        """Scan of the cik x label table of *year*, None when there is no data for it."""
+        name = wide_table(year)
+        if not (self.data_dir / name).exists():
+            return None
+        return self._cached(name, "scan", pl.scan_parquet)
+
+    def stats(self) -> pl.DataFrame:
+        """Per file: cache hits and misses, invalidations and time spent loading."""
+        with self._lock:
+            rows = [{"file": name, **vars(stats)} for name, stats in sorted(self._stats.items())]
+        return pl.DataFrame(rows, schema={
+            "file": pl.String, "hits": pl.Int64, "misses": pl.Int64, "invalidations": pl.Int64,
+            "unchanged_rewrites": pl.Int64, "load_seconds": pl.Float64,
+        }).with_columns(
+            (pl.col("hits") / (pl.col("hits") + pl.col("misses"))).alias("hit_rate"),
+        )
+
+
+@st.cache_resource
+def get_data_store() -> DataStore:
+    """The process's DataStore, shared by every session."""
+    return DataStore()
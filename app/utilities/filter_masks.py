@@ -0,0 +1,58 @@
+"""Row masks of the column filters of a table, kept across reruns."""
+
+from __future__ import annotations
+
+from collections.abc import Hashable, Iterable
+
+import numpy as np
+import polars as pl
+
+
+class FilterMasks:
+    """One boolean mask per filtered column, recomputed only when its range changes.
+
+    A session keeps one of these per table it filters. Masks are dropped when
+    *table_key* changes, i.e. when the rows they index are different ones.
+    """
+
+    def __init__(self) -> None:
+        self._table_key: Hashable = None
+        self._masks: dict[str, tuple[tuple[float, float], np.ndarray]] = {}
+        self._keep: tuple[frozenset, np.ndarray] | None = None
+        self.computed = 0
+
+    def rows(
+        self,
+        table_key: Hashable,
+        frame: pl.DataFrame,
+        ranges: dict[str, tuple[float, float] | None],
+        keep_ciks: Iterable[int] = (),
+    ) -> np.ndarray:
+        """Indices of the rows of *frame* within every column's range, or with a cik in *keep_ciks*.
+
+        A column without a range does not filter; nulls are outside any range.
+        """
+        if table_key != self._table_key:
+            self._table_key = table_key
+            self._masks.clear()
+            self._keep = None
+
+        ranges = {column: tuple(bounds) for column, bounds in ranges.items() if bounds is not None}
+        for column in self._masks.keys() - ranges.keys():
+            del self._masks[column]
+        for column, bounds in ranges.items():
+            if column not in self._masks or self._masks[column][0] != bounds:
+                mask = frame[column].is_between(*bounds).fill_null(False).to_numpy()
+                self._masks[column] = bounds, mask
+                self.computed += 1
+
+        if not self._masks:
+            return np.arange(frame.height)
+        within = np.logical_and.reduce([mask for _, mask in self._masks.values()])
+
+        keep_ciks = frozenset(keep_ciks)
+        if keep_ciks:
+            if self._keep is None or self._keep[0] != keep_ciks:
+                self._keep = keep_ciks, frame["cik"].is_in(list(keep_ciks)).to_numpy()
+            within |= self._keep[1]
+        return np.flatnonzero(within)
@@ -0,0 +1,64 @@
+"""Bounded LRU cache of derived polars frames, shared by every session."""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+
+import polars as pl
+
+
+class FrameCache:
+    """Least recently used frames, evicted once they add up to more than *max_bytes*.
+
+    Sizes are polars' estimated_size(); a frame larger than the whole budget is
+    returned but not kept. Building happens outside the lock, so two sessions
+    missing on the same key at once both build it.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._frames: OrderedDict[Hashable, tuple[pl.DataFrame, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, build: Callable[[], pl.DataFrame]) -> pl.DataFrame:
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return self._frames[key][0]
+            self.misses += 1
+
+        frame = build()
+        size = frame.estimated_size()
+        if size > self.max_bytes:
+            return frame
+
+        with self._lock:
+            if key in self._frames:
+                self._bytes -= self._frames.pop(key)[1]
+            self._frames[key] = (frame, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._frames.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+        return frame
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._frames),
+                "megabytes": self._bytes / 2**20,
+                "max_megabytes": self.max_bytes / 2**20,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,23 @@
+"""Zero-copy access to the Arrow IPC files written by the data pipeline."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import polars as pl
+import pyarrow as pa
+
+
+def read_mapped(path: str | Path, columns: list[str] | None = None) -> pl.DataFrame:
+    """Memory-map an uncompressed Arrow IPC file as a polars DataFrame.
+
+    Nothing is decoded: the pages of the columns a query touches are faulted
+    in from the OS page cache, which every session and process mapping the
+    same file shares. Pass *columns* to map only those; polars scans the
+    string views of every column it is handed.
+    """
+    table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    # one chunk per record batch; rechunking would copy the file into memory
+    return pl.from_arrow(table, rechunk=False)
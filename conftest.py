@@ -0,0 +1,127 @@
+# shared fixtures: stand-ins for the EDGAR api and a small fetched.parquet
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def make_tenk(n=400, seed=0):
+    """ 10-K facts of a company, as edgar's facts query returns them """
+    rng = np.random.default_rng(seed)
+    concepts = ['dei:EntityPublicFloat', 'dei:EntityCommonStockSharesOutstanding'] + [f'us-gaap:Concept{i}' for i in range(40)]
+    concept = rng.choice(concepts, n)
+    end = pd.to_datetime('2010-12-31') + pd.to_timedelta(rng.integers(0, 12, n) * 365, 'D')
+    days = rng.choice([365, 90, 0], n)
+    start = end - pd.to_timedelta(days, 'D')
+    return pd.DataFrame({
+        'concept': concept, 'label': [c.split(':')[1] for c in concept],
+        'value': rng.choice([1000.5, 10005.0, 120000.0, 1.25e6, 3.0], n) * rng.integers(1, 4, n),
+        'numeric_value': 0.0, 'unit': 'USD', 'scale': None,
+        'period_start': [s.date() if d else None for s, d in zip(start, days)],
+        'period_end': [e.date() for e in end],
+        'period_type': ['duration' if d else 'instant' for d in days],
+        'fiscal_year': end.year + rng.integers(0, 2, n),
+        'fiscal_period': 'FY',
+        'filing_date': [e.date() for e in end],
+        'form_type': '10-K', 'accession': [f'acc-{i}' for i in rng.integers(0, 10, n)],
+        'data_quality': 'high', 'confidence_score': 1.0, 'is_audited': True, 'is_estimated': False,
+        'statement_type': rng.choice(['BalanceSheet', 'IncomeStatement', None], n),
+    })
+
+
+class StubFact:
+    def __init__(self, row):
+        self.filing_date, self.accession = row.filing_date, row.accession
+
+
+class StubQuery:
+    """ the parts of edgar's FactQuery the fetch uses """
+    def __init__(self, df):
+        self.df = df
+
+    def by_form_type(self, form_type):
+        return StubQuery(self.df[self.df['form_type'] == form_type])
+
+    def by_concept(self, concept):
+        concept = concept.lower()
+        matches = (self.df['concept'].str.lower().str.contains(concept, regex=False)
+                   | self.df['label'].str.lower().str.contains(concept, regex=False))
+        return StubQuery(self.df[matches])
+
+    def by_period_type(self, period_type):
+        start, end = pd.to_datetime(self.df['period_start']), pd.to_datetime(self.df['period_end'])
+        months = (end.dt.year - start.dt.year) * 12 + end.dt.month - start.dt.month + 1
+        annual = start.notna() & (self.df['period_type'] == 'duration') & ((months - 12).abs() <= 1)
+        return StubQuery(self.df[annual])
+
+    def by_statement_type(self, statement_type):
+        return StubQuery(self.df[self.df['statement_type'] == statement_type])
+
+    def to_dataframe(self):
+        return self.df.reset_index(drop=True).copy()
+
+    def execute(self):
+        return [StubFact(row) for row in self.df.itertuples()]
+
+
+class StubFacts:
+    def __init__(self, df):
+        self.df = df
+
+    def query(self):
+        return StubQuery(self.df)
+
+
+class StubCompany:
+    """ edgar.Company with deterministic facts per cik, each request taking `latency` seconds """
+    latency = 0.0
+
+    def __init__(self, cik):
+        self.cik = cik
+
+    def get_facts(self):
+        time.sleep(self.latency)
+        return StubFacts(make_tenk(seed=self.cik))
+
+    @property
+    def name(self):
+        time.sleep(self.latency)
+        return f'Company {self.cik}'
+
+
+def make_fetched(n=20_000, concepts=12, ciks=300, seed=0):
+    """ rows of fetched.parquet, with srt/us-gaap concepts sharing a label """
+    rng = np.random.default_rng(seed)
+    names = np.array([f'Concept{i}' for i in range(concepts)])
+    idx = rng.integers(0, concepts, n)
+    prefix = np.where(idx % 4 == 0, rng.choice(['srt', 'us-gaap'], n), 'us-gaap')
+    cik = rng.integers(0, ciks, n)
+    year = rng.integers(2012, 2016, n)
+    end = pd.to_datetime(year.astype(str)) + pd.to_timedelta(rng.choice([0, 180, 364], n), 'D')
+    value = rng.choice([1.0, -2.5, 1e6, np.nan], n) * rng.integers(1, 5, n)
+    return pd.DataFrame({
+        'concept': pd.Series(prefix).str.cat(pd.Series(names[idx]), sep=':'),
+        'label': pd.Series(names[idx]).str.replace('Concept', 'Label '),
+        'value': value, 'numeric_value': value, 'unit': 'USD',
+        'period_start': (end - pd.Timedelta(days=364)).date, 'period_end': end.astype('datetime64[us]'),
+        'period_type': 'duration', 'fiscal_year': year, 'fiscal_period': 'FY', 'form_type': '10-K',
+        'data_quality': 'high', 'confidence_score': 0.8, 'is_audited': False, 'is_estimated': False,
+        'statement_type': rng.choice(['BalanceSheet', 'IncomeStatement', None], n),
+        'cik': cik, 'tickers': pd.Series(cik).map('T{}'.format), 'company': pd.Series(cik).map('Company {}'.format),
+    })
+
+
+@pytest.fixture
+def stub_company():
+    return StubCompany
+
+
+@pytest.fixture
+def tenk():
+    return make_tenk
+
+
+@pytest.fixture
+def fetched():
+    return make_fetched
@@ -0,0 +1,187 @@
+# append-only, resumable storage for the fetch pipeline
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+class CheckpointWriter:
+    """Streams fetched companies to a partitioned dataset, one parquet fragment per batch
+
+    `manifest.jsonl` lists the fragments together with the CIKs they cover and
+    the latest 10-K filing seen for each of them.
+    A fragment is only listed once it is fully written, so after a crash the
+    CIKs in the manifest are exactly the completed ones and a new run can skip them.
+    A `raw_facts.RawFactsWriter` fed by the fetch is flushed before each manifest
+    entry, so completed CIKs are also in the raw layer.
+    """
+    BATCH_SIZE = 1000
+
+    def __init__(self, directory, batch_size=None, raw_facts=None):
+        self.directory = Path(directory)
+        self.raw_facts = raw_facts
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.manifest = self.directory / 'manifest.jsonl'
+        self.batch_size = batch_size or self.BATCH_SIZE
+
+        self.fragments, self.completed = read_manifest(self.directory)
+
+        # fragments written by an interrupted run but never listed
+        for path in self.directory.glob('part-*.parquet*'):
+            if path.name not in self.fragments:
+                path.unlink()
+
+        self.batch = []
+        self.batch_ciks = []
+        self.batch_latest = []
+
+    def add(self, cik, data, latest=None):
+        """Record a finished company; `data` is None when it had no facts
+
+        `latest` is the (filing_date, accession) of the newest 10-K in its facts.
+        """
+        self.batch_ciks.append(cik)
+        self.batch_latest.append(None if latest is None else [str(latest[0]), latest[1]])
+        if data is not None:
+            self.batch.append(data)
+        if len(self.batch_ciks) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch_ciks:
+            return
+
+        fragment = None
+        if self.batch:
+            fragment = f'part-{len(self.fragments):05d}.parquet'
+            tmp_path = self.directory / (fragment + '.tmp')
+            pd.concat(self.batch).to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self.directory / fragment)
+            self.fragments.append(fragment)
+
+        if self.raw_facts is not None:
+            self.raw_facts.flush()
+
+        with open(self.manifest, 'a') as f:
+            f.write(json.dumps({'fragment': fragment, 'ciks': self.batch_ciks,
+                                'latest': self.batch_latest}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.completed.update(self.batch_ciks)
+        self.batch = []
+        self.batch_ciks = []
+        self.batch_latest = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_manifest(directory):
+    """Fragment names and completed CIKs recorded in a checkpoint directory"""
+    fragments = []
+    completed = set()
+    manifest = Path(directory) / 'manifest.jsonl'
+    if manifest.exists():
+        for line in manifest.read_text().splitlines():
+            entry = json.loads(line)
+            if entry['fragment'] is not None:
+                fragments.append(entry['fragment'])
+            completed.update(entry['ciks'])
+    return fragments, completed
+
+
+def read_filing_marks(directory):
+    """Per-CIK high-water marks recorded in a checkpoint directory
+
+    One row per completed CIK; filing_date/accession are null for companies without 10-K facts.
+    """
+    rows = []
+    manifest = Path(directory) / 'manifest.jsonl'
+    if manifest.exists():
+        for line in manifest.read_text().splitlines():
+            entry = json.loads(line)
+            for cik, latest in zip(entry['ciks'], entry['latest']):
+                filing_date, accession = latest or (None, None)
+                rows.append((cik, filing_date, accession))
+
+    marks = pd.DataFrame(rows, columns=['cik', 'filing_date', 'accession'])
+    marks['filing_date'] = pd.to_datetime(marks['filing_date'])
+    return marks
+
+
+def fragment_files(directories):
+    """Paths of the fragments listed in checkpoint manifests, in manifest order"""
+    files = []
+    for directory in directories:
+        fragments, _ = read_manifest(directory)
+        files.extend(str(Path(directory) / fragment) for fragment in fragments)
+    return files
+
+
+def unified_schema(files):
+    """one schema for fragments whose column sets differ; missing columns read as null"""
+    return pa.unify_schemas([pq.read_schema(f).remove_metadata() for f in files],
+                            promote_options='permissive')
+
+
+def read_fragments(directory, ciks=None):
+    """Table of the companies in a checkpoint directory, only those in `ciks` when given
+
+    A CIK written more than once (fetched again after its job lease ran out)
+    is read from the last fragment that lists it.
+    """
+    directory = Path(directory)
+    last = {}
+    for line in (directory / 'manifest.jsonl').read_text().splitlines():
+        entry = json.loads(line)
+        for cik in entry['ciks']:
+            last[cik] = entry['fragment']
+    if ciks is not None:
+        last = {cik: last[cik] for cik in ciks if cik in last}
+
+    by_fragment = {}
+    for cik, fragment in last.items():
+        if fragment is not None:
+            by_fragment.setdefault(fragment, []).append(cik)
+    if not by_fragment:
+        return None
+
+    files = [str(directory / fragment) for fragment in by_fragment]
+    schema = unified_schema(files)
+    return pa.concat_tables([
+        ds.dataset(f, schema=schema, format='parquet').to_table(filter=pc.field('cik').isin(fragment_ciks))
+        for f, fragment_ciks in zip(files, by_fragment.values())
+    ])
+
+
+def consolidate(directories, file_name):
+    """Stream the fragments listed in checkpoint manifests into a single parquet file
+
+    Fragments are written in manifest order, directory by directory, and read
+    one record batch at a time so memory does not grow with the dataset.
+    Column sets can differ between fragments; missing columns are null.
+    """
+    files = fragment_files(directories)
+    if not files:
+        raise ValueError(f'no fetched data in {", ".join(map(str, directories))}')
+
+    schema = unified_schema(files)
+
+    tmp_path = f'{file_name}.tmp'
+    with pq.ParquetWriter(tmp_path, schema) as out:
+        for f in files:
+            for batch in ds.dataset(f, schema=schema, format='parquet').to_batches():
+                out.write_batch(batch)
+    os.replace(tmp_path, file_name)
@@ -0,0 +1,63 @@
+# value statistics and symlog histograms, as the app's filter histograms draw them
+import numpy as np
+import polars as pl
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+HISTOGRAM_MAXBINS = 150
+
+
+def value_distributions(values, keys, maxbins=HISTOGRAM_MAXBINS):
+    """ statistics and symlog histogram of `value` for each group of `keys` """
+    values = values.with_columns(
+        (pl.col('value').sign() * pl.col('value').abs().log1p() / np.log(10)).alias('symlog'))
+    stats = values.group_by(keys).agg(
+        pl.len().cast(pl.UInt32).alias('count'),
+        pl.col('value').min().alias('min'),
+        pl.col('value').max().alias('max'),
+        *(pl.col('value').quantile(q, 'linear').alias(f'q{round(q * 100):02d}') for q in QUANTILES),
+        pl.col('symlog').min().alias('symlog_min'),
+        pl.col('symlog').max().alias('symlog_max'),
+    )
+
+    grid = [nice_bins(lo, hi, maxbins) for lo, hi in stats.select('symlog_min', 'symlog_max').iter_rows()]
+    start, stop, step = (pl.Series(column, dtype=pl.Float64) for column in zip(*grid))
+    stats = stats.with_columns(start=start, stop=stop, step=step).drop('symlog_min', 'symlog_max')
+
+    # as vega's bin transform: clamped into [start, stop - step], floored with an epsilon
+    clamped = pl.col('symlog').clip(pl.col('start'), pl.col('stop') - pl.col('step'))
+    last = ((pl.col('stop') - pl.col('start')) / pl.col('step')).round() - 1
+    index = pl.min_horizontal(((clamped - pl.col('start')) / pl.col('step') + 1e-14).floor(), last.clip(0))
+    edge = lambda s: s.sign() * (10 ** s.abs() - 1)
+    bins = (
+        values.join(stats.select(*keys, 'start', 'stop', 'step'), on=keys, nulls_equal=True)
+        .group_by(*keys, index.alias('bin'))
+        .agg(pl.len().cast(pl.UInt32).alias('count'), pl.col('start', 'step').first())
+        .sort('bin')
+        .select(*keys, pl.struct(
+            edge(pl.col('start') + pl.col('step') * pl.col('bin')).alias('x1'),
+            edge(pl.col('start') + pl.col('step') * (pl.col('bin') + 1)).alias('x2'),
+            'count',
+        ).alias('bins'))
+        .group_by(keys, maintain_order=True).agg('bins')
+    )
+    return stats.drop('start', 'stop', 'step').join(bins, on=keys, nulls_equal=True)
+
+
+def nice_bins(lo, hi, maxbins):
+    """ start, stop and step of at most `maxbins` bins over [lo, hi], as vega's bin() picks them """
+    span = (hi - lo) or abs(lo) or 1.0
+    level = np.ceil(np.log10(maxbins))
+    step = 10 ** (round(np.log10(span)) - level)
+    while np.ceil(span / step) > maxbins:
+        step *= 10
+    for divisor in (5, 2):
+        if span / (step / divisor) <= maxbins:
+            step /= divisor
+
+    log_step = np.log10(step)
+    precision = 0 if log_step >= 0 else int(-log_step) + 1
+    eps = 10 ** (-precision - 1)
+    nice_lo = np.floor(lo / step + eps) * step
+    start = nice_lo - step if lo < nice_lo else nice_lo
+    stop = np.ceil(hi / step) * step
+    return float(start), float(stop if stop > start else start + step), float(step)
@@ -0,0 +1,226 @@
+# persistent on-disk cache for EDGAR responses, shared by the pipeline and the app
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import edgar
+
+DEFAULT_DIRECTORY = Path(__file__).resolve().parent / 'edgar_cache'
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+# expired entries are dropped every this many puts, and when over budget
+EVICT_EVERY = 256
+# eviction makes this much room below max_bytes, so the next puts do not evict again
+EVICT_TO = 0.9
+
+DAY = 24 * 60 * 60
+
+# how long each kind of response stays fresh; None never expires
+TTLS = {
+    'get_facts': DAY,          # grows with every new filing
+    'company_name': 30 * DAY,
+    'get_filings': DAY,
+    'xbrl': None,              # a filing's XBRL never changes
+    'find': 7 * DAY,
+}
+
+
+class EdgarCache:
+    """Content-addressed cache: a SQLite index over zlib-compressed pickled blobs
+
+    Entries map a request key to the sha256 of its blob, so identical responses
+    are stored once. Entries expire after their TTL, and the least recently used
+    ones are evicted once the blobs exceed `max_bytes`. Safe to share between
+    threads and processes.
+
+    Puts keep a running total of the blob bytes, so the index is only scanned
+    when it goes over budget (or every EVICT_EVERY puts). The total counts
+    this process's writes: other processes' are seen at the next scan.
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.blobs = self.directory / 'blobs'
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.directory / 'index.sqlite', timeout=30,
+                                  check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS entries (
+                               key TEXT PRIMARY KEY,
+                               digest TEXT NOT NULL,
+                               size INTEGER NOT NULL,
+                               expires REAL,
+                               accessed REAL NOT NULL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)')
+
+        self.total = self.size()
+        self.puts = 0
+
+        self.stats_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_read': 0, 'bytes_written': 0, 'uncacheable': 0}
+
+    @staticmethod
+    def make_key(namespace, *args):
+        return namespace + ':' + ':'.join(map(str, args))
+
+    def _count(self, stat, n=1):
+        with self.stats_lock:
+            self.stats[stat] += n
+
+    def _blob_path(self, digest):
+        return self.blobs / digest[:2] / digest
+
+    def get(self, key):
+        """Cached value for `key`; raises KeyError when missing or expired"""
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT digest, expires FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None and (row[1] is None or row[1] > now):
+                self.db.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        if row is None or (row[1] is not None and row[1] <= now):
+            raise KeyError(key)
+
+        try:
+            blob = self._blob_path(row[0]).read_bytes()
+        except FileNotFoundError:
+            raise KeyError(key)
+        self._count('bytes_read', len(blob))
+        return pickle.loads(zlib.decompress(blob))
+
+    def put(self, key, value, ttl=None):
+        """Store `value`; returns False when it cannot be pickled"""
+        try:
+            blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            self._count('uncacheable')
+            return False
+
+        digest = hashlib.sha256(blob).hexdigest()
+        path = self._blob_path(digest)
+        written = 0
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_name(f'{digest}.{os.getpid()}.{threading.get_ident()}.tmp')
+            tmp_path.write_bytes(blob)
+            os.replace(tmp_path, path)
+            written = len(blob)
+            self._count('bytes_written', written)
+
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        with self.lock:
+            old = self.db.execute('SELECT digest, size FROM entries WHERE key = ?', (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                            (key, digest, len(blob), expires, now))
+            if old is not None and old[0] != digest and self._drop_blob(old[0]):
+                written -= old[1]
+            self.total += written
+            self.puts += 1
+            due = self.total > self.max_bytes or self.puts % EVICT_EVERY == 0
+        if due:
+            self.evict()
+        return True
+
+    def invalidate(self, key):
+        """Forget `key`, e.g. for a company known to have new filings"""
+        with self.lock:
+            old = self.db.execute('SELECT digest, size FROM entries WHERE key = ?', (key,)).fetchone()
+            if old is not None:
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                if self._drop_blob(old[0]):
+                    self.total -= old[1]
+
+    def get_or_fetch(self, key, fetch, ttl=None):
+        """Cached value for `key`, calling `fetch()` and storing its result on a miss
+
+        None results are not cached: edgar returns None for data that may appear later.
+        """
+        try:
+            value = self.get(key)
+        except KeyError:
+            pass
+        else:
+            self._count('hits')
+            return value
+
+        self._count('misses')
+        value = fetch()
+        if value is not None:
+            self.put(key, value, ttl)
+        return value
+
+    def _drop_blob(self, digest):
+        """delete a blob once no entry refers to it (caller holds the lock); True when it was"""
+        shared = self.db.execute('SELECT 1 FROM entries WHERE digest = ? LIMIT 1', (digest,)).fetchone()
+        if shared is None:
+            self._blob_path(digest).unlink(missing_ok=True)
+        return shared is None
+
+    def evict(self):
+        """Drop expired entries, then, when over `max_bytes`, least recently used ones down to EVICT_TO of it"""
+        with self.lock:
+            expired = self.db.execute('SELECT key, digest FROM entries WHERE expires <= ?',
+                                      (time.time(),)).fetchall()
+            for key, digest in expired:
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._drop_blob(digest)
+
+            total = self.size()
+            if total > self.max_bytes:
+                for key, digest, size in self.db.execute(
+                        'SELECT key, digest, size FROM entries ORDER BY accessed').fetchall():
+                    self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                    # a blob shared with other entries frees nothing until the last of them goes
+                    if self._drop_blob(digest):
+                        total -= size
+                    if total <= self.max_bytes * EVICT_TO:
+                        break
+            self.total = total
+
+    def size(self):
+        """bytes of distinct blobs referenced by the index"""
+        row = self.db.execute('SELECT SUM(size) FROM (SELECT DISTINCT digest, size FROM entries)').fetchone()
+        return row[0] or 0
+
+    def hit_rate(self):
+        with self.stats_lock:
+            hits, lookups = self.stats['hits'], self.stats['hits'] + self.stats['misses']
+        return hits / lookups if lookups else 0.0
+
+
+# edgartools calls used by the pipeline and the app
+
+def cached(cache, namespace, *args, fetch):
+    """`fetch()` through `cache` under the key (namespace, *args), with the namespace's TTL"""
+    if cache is None:
+        return fetch()
+    return cache.get_or_fetch(EdgarCache.make_key(namespace, *args), fetch, TTLS[namespace])
+
+
+def get_facts(company, cache=None, fetch=None):
+    return cached(cache, 'get_facts', company.cik, fetch=fetch or company.get_facts)
+
+
+def company_name(company, cache=None, fetch=None):
+    return cached(cache, 'company_name', company.cik, fetch=fetch or (lambda: company.name))
+
+
+def get_filings(company, cache=None, **kwargs):
+    args = sorted(kwargs.items())
+    return cached(cache, 'get_filings', company.cik, args, fetch=lambda: company.get_filings(**kwargs))
+
+
+def filing_xbrl(filing, cache=None):
+    return cached(cache, 'xbrl', filing.accession_no, fetch=filing.xbrl)
+
+
+def find(query, cache=None):
+    return cached(cache, 'find', query, fetch=lambda: edgar.find(query))
@@ -1,74 +1,553 @@
+import argparse
+import math
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
-from edgar import set_identity, Company, reference
-from edgar.enums import PeriodType
+from edgar import set_identity, get_filings, Company, reference
 
 
-from rich.progress import track
+from rich.console import Console
+from rich.progress import Progress, TextColumn, BarColumn, MofNCompleteColumn, TimeRemainingColumn, track
+from rich.table import Table
+
+import edgar_cache
+from checkpoint import CheckpointWriter, consolidate, fragment_files, read_filing_marks, read_fragments
+from job_queue import JobQueue
+from raw_facts import RAW_FACTS, BUCKETS, RawFactsWriter, read_bucket
+from ticker_index import build_ticker_index, load_ticker_index, tickers_by_cik
 
 # set to proper id for edgar usage
 id = "Your Name yourname@domain.com"
 set_identity(id)
 
+# SEC fair-access policy: no more than 10 requests per second per client
+SEC_MAX_REQUESTS_PER_SECOND = 10
+
+# responses worth retrying after backing off
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+
+
+class RateLimiter:
+    """Token bucket shared by all fetch workers
+
+    On throttling (429/5xx) the refill rate is halved and the bucket is paused,
+    then it recovers additively on each successful request.
+    """
+    def __init__(self, rate=SEC_MAX_REQUESTS_PER_SECOND, capacity=None, min_rate=0.5):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a request token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.updated = self.paused_until
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def back_off(self, delay):
+        """Throttled by the server: slow down and pause every worker for `delay` seconds"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def recover(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+
+def _status_code(exc):
+    """HTTP status of a failed edgar/httpx request, if any"""
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return status
+
+
+def call_with_backoff(fn, limiter, retries=MAX_RETRIES, base_delay=1.0):
+    """Rate limited call to EDGAR, retried with exponential backoff on 429/5xx"""
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            result = fn()
+        except Exception as exc:
+            if attempt == retries or _status_code(exc) not in RETRY_STATUS_CODES:
+                raise
+            limiter.back_off(base_delay * 2 ** attempt)
+            continue
+        limiter.recover()
+        return result
+
 
-def selected_datapoints(file_name='fetched.parquet'):
+def selected_datapoints(file_name='fetched.parquet', workers=1, company_cls=Company, limiter=None,
+                        checkpoint_dir=None, ciks=None, cache=None, raw_dir=RAW_FACTS):
     """Fetch selected datapoints across years and companies
 
-    Limited to companies with an active ticker symbol
+    Limited to companies with an active ticker symbol, or to `ciks` when given.
+    With workers > 1, companies are fetched by a thread pool sharing one rate limiter.
+    `company_cls` can be swapped for a stub with the `Company` interface.
+    With an `edgar_cache.EdgarCache`, responses already on disk are not requested again.
+
+    Companies are streamed in batches to `checkpoint_dir` (default: `<file_name stem>.parts`);
+    an interrupted run picks up after the last completed batch. The latest 10-K
+    seen for every company is written next to the output (see `marks_path`).
+    If none of the companies has 10-K facts, only the marks are written.
+    The untouched 10-K facts go to the raw layer in `raw_dir` (None: not kept),
+    from which `rebuild_datapoints` can redo the cleaning without refetching.
     """
-    all_data = []
+    limiter = limiter or RateLimiter()
+    checkpoint_dir = checkpoint_dir or Path(file_name).with_suffix('.parts')
 
     # querying only companies with a ticker
-    ticker_cik_refs = reference.tickers.get_cik_tickers()
+    ticker_index = build_ticker_index(reference.tickers.get_cik_tickers())
+    tickers = tickers_by_cik(ticker_index)
+    if ciks is None:
+        ciks = ticker_index['cik'].tolist()
 
-    i = 0
-    for cik in track(ticker_cik_refs['cik'].unique()):
-        cik = int(cik)
+    fetch_to_checkpoint(ciks, tickers, checkpoint_dir, workers, company_cls, limiter, cache, raw_dir=raw_dir)
 
-        i += 1
-        if i > 0 and i % 1000 == 0:
-            pd.concat(all_data).to_parquet(file_name, index=False)
+    if fragment_files([checkpoint_dir]):
+        consolidate([checkpoint_dir], file_name)
+    else:
+        print(f'no 10-K facts for any of the {len(ciks)} companies: {file_name} not written')
+    read_filing_marks(checkpoint_dir).to_parquet(marks_path(file_name), index=False)
+    shutil.rmtree(checkpoint_dir)
 
-        company = Company(cik)
-        facts = company.get_facts()
 
-        def query(): return facts.query().by_form_type('10-K')
+def fetch_to_checkpoint(ciks, tickers, checkpoint_dir, workers=1, company_cls=Company, limiter=None,
+                        cache=None, show_progress=True, raw_dir=None):
+    """Fetch `ciks` into the checkpoint dataset at `checkpoint_dir`, skipping completed ones
 
-        if facts is None:  # make sure the data is available
-            continue
+    `tickers` maps CIKs to their comma-joined tickers.
+    """
+    raw_facts = None if raw_dir is None else RawFactsWriter(raw_dir)
+
+    def fetch(cik):
+        return fetch_company(cik, tickers.get(cik, ''), company_cls, limiter, cache, raw_facts)
+
+    with CheckpointWriter(checkpoint_dir, raw_facts=raw_facts) as checkpoint:
+        ciks = [cik for cik in ciks if cik not in checkpoint.completed]
+
+        def collect(results, on_result=None):
+            for i, (cik, (data, latest)) in enumerate(zip(ciks, results), start=1):
+                checkpoint.add(cik, data, latest)
+                if on_result is not None:
+                    on_result(i)
+
+        if workers == 1:
+            collect(map(fetch, track(ciks) if show_progress else ciks))
+        elif not show_progress:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                collect(pool.map(fetch, ciks))
+        else:
+            with WorkerProgress(len(ciks)) as progress:
+                # map yields in input order, so the output matches a serial run
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    collect(pool.map(progress.wrap(fetch), ciks), progress.report)
+
+
+def sharded_datapoints(file_name='fetched.parquet', shards=None, workers=1, company_cls=Company,
+                       cache_dir=None, rate=SEC_MAX_REQUESTS_PER_SECOND, raw_dir=RAW_FACTS):
+    """selected_datapoints split over `shards` worker processes (default: one per core)
+
+    The CIK universe is cut into contiguous shards on checkpoint batch boundaries.
+    Each process fetches its shard into its own checkpoint dataset with a
+    1/shards share of the total request `rate`. The fragments are then merged in
+    universe order, exactly as a serial run merges its own, so the output file
+    is byte-for-byte the same. `company_cls` must be picklable.
+    """
+    shards = shards or os.cpu_count()
+    parts_dir = Path(file_name).with_suffix('.parts')
+
+    ticker_index = build_ticker_index(reference.tickers.get_cik_tickers())
+    tickers = tickers_by_cik(ticker_index)
+    ciks = ticker_index['cik'].tolist()
+
+    batches_per_shard = math.ceil(math.ceil(len(ciks) / CheckpointWriter.BATCH_SIZE) / shards)
+    shard_size = batches_per_shard * CheckpointWriter.BATCH_SIZE
+    chunks = [ciks[i:i + shard_size] for i in range(0, len(ciks), shard_size)]
+    shard_dirs = [parts_dir / f'shard-{i:03d}' for i in range(len(chunks))]
+
+    with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+        futures = [
+            pool.submit(fetch_shard, chunk, {cik: tickers[cik] for cik in chunk}, shard_dir,
+                        workers, company_cls, rate / len(chunks), cache_dir, raw_dir)
+            for chunk, shard_dir in zip(chunks, shard_dirs)
+        ]
+        for future in track(as_completed(futures), total=len(futures), description='shards'):
+            future.result()
+
+    consolidate(shard_dirs, file_name)
+    marks = pd.concat([read_filing_marks(shard_dir) for shard_dir in shard_dirs])
+    marks.to_parquet(marks_path(file_name), index=False)
+    shutil.rmtree(parts_dir)
+
+
+def fetch_shard(ciks, tickers, checkpoint_dir, workers, company_cls, rate, cache_dir, raw_dir):
+    """worker process entry point for sharded_datapoints"""
+    cache = None if cache_dir is None else edgar_cache.EdgarCache(cache_dir)
+    fetch_to_checkpoint(ciks, tickers, checkpoint_dir, workers, company_cls, RateLimiter(rate=rate),
+                        cache, show_progress=False, raw_dir=raw_dir)
+
+
+def queue_worker(queue, parts_dir, workers=1, company_cls=Company, limiter=None, cache=None,
+                 lease_size=50, poll=5.0, raw_dir=RAW_FACTS):
+    """Drain a `job_queue.JobQueue` of CIKs until no job is pending or running
+
+    Any number of these can run at once, in processes on this host or on hosts
+    sharing `parts_dir` and the queue file. Each worker checkpoints into its own
+    `parts_dir/<worker id>` and only marks jobs done once their batch is on disk.
+    A company that raises is handed back to the queue, which retries it later or
+    dead-letters it; the rest of the run carries on.
+    """
+    limiter = limiter or RateLimiter()
+    worker = JobQueue.worker_id()
+    tickers = tickers_by_cik(build_ticker_index(reference.tickers.get_cik_tickers(), path=None))
+    raw_facts = None if raw_dir is None else RawFactsWriter(raw_dir)
+
+    def fetch(cik):
+        try:
+            return cik, fetch_company(cik, tickers.get(cik, ''), company_cls, limiter, cache, raw_facts), None
+        except Exception as exc:
+            return cik, None, f'{type(exc).__name__}: {exc}'
+
+    progress = Progress(TextColumn('{task.description}'), BarColumn(), MofNCompleteColumn(),
+                        TextColumn('{task.fields[status]}'))
+    with progress, CheckpointWriter(Path(parts_dir) / worker, batch_size=lease_size, raw_facts=raw_facts) as checkpoint, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        overall = progress.add_task(f'queue (worker {worker})', total=None, status='')
+        while True:
+            ciks = queue.lease(worker, lease_size)
+            if not ciks:
+                if queue.is_drained():
+                    break
+                # jobs are backing off, or leased by other workers that may yet die
+                wait = queue.next_retry()
+                time.sleep(poll if wait is None else min(poll, max(wait, 0.1)))
+                continue
+
+            done = []
+            for cik, result, error in pool.map(fetch, ciks):
+                if error is None:
+                    checkpoint.add(cik, *result)
+                    done.append(cik)
+                else:
+                    queue.fail(cik, worker, error)
+            checkpoint.flush()
+            queue.complete(done, worker)
+            status = queue.status()
+            progress.update(overall, completed=status['done'] + status['failed'], status=format_status(status),
+                            total=sum(status[state] for state in ('done', 'running', 'pending', 'failed')))
+
+
+def merge_queue(queue, parts_dir, file_name='fetched.parquet'):
+    """Write the companies completed through `queue` to `file_name`, in queue order
+
+    A company is fetched more than once when a lease runs out while it is being
+    fetched; only the last copy written by the worker that completed it is kept.
+    """
+    if not queue.is_drained():
+        raise ValueError(f'{queue.path} still has pending jobs: {format_status(queue.status())}')
+
+    done_by = queue.done_by()
+    workers = {}
+    for cik, worker in done_by.items():
+        workers.setdefault(worker, []).append(cik)
+
+    tables, marks = [], []
+    for worker, ciks in workers.items():
+        directory = Path(parts_dir) / worker
+        table = read_fragments(directory, ciks)
+        if table is not None:
+            tables.append(table)
+        worker_marks = read_filing_marks(directory).drop_duplicates('cik', keep='last')
+        marks.append(worker_marks[worker_marks['cik'].isin(ciks)])
+    if not tables:
+        raise ValueError(f'no fetched data in {parts_dir}')
+
+    order = pd.Series(range(len(done_by)), index=list(done_by))
+    data = pa.concat_tables(tables, promote_options='permissive')
+    data = data.take(order.loc[data['cik'].to_numpy()].to_numpy().argsort(kind='stable'))
+    tmp_path = f'{file_name}.tmp'
+    pq.write_table(data, tmp_path)
+    os.replace(tmp_path, file_name)
+
+    marks = pd.concat(marks)
+    marks = marks.iloc[order.loc[marks['cik']].to_numpy().argsort(kind='stable')]
+    marks.to_parquet(marks_path(file_name), index=False)
+
+    dead = queue.dead_letters()
+    if dead:
+        table = Table('CIK', 'attempts', 'error',
+                      title=f'{len(dead)} companies failed after retries (retry them with --retry-failed)')
+        for cik, attempts, error in dead[:10]:
+            table.add_row(str(cik), str(attempts), error)
+        Console().print(table)
+
+
+def format_status(status):
+    eta = 'unknown' if status['eta'] is None else f'{status["eta"] / 60:.0f} min'
+    return (f'{status["done"]} done, {status["running"]} running, {status["pending"]} pending, '
+            f'{status["failed"]} failed; {status["throughput"]:.2f} companies/s, ETA {eta}')
+
+
+def marks_path(file_name):
+    """per-CIK high-water marks (latest 10-K filing fetched) stored alongside a fetched dataset"""
+    return Path(file_name).with_suffix('.marks.parquet')
+
+
+def changed_companies(marks, ciks, since_days=7):
+    """CIKs in `ciks` that filed a 10-K newer than their high-water mark, or were never fetched
+
+    Returned with the date of the latest 10-K in the filing index of each CIK found there.
+    The filing index is read from a week before the newest mark on, to cover
+    the lag between a filing and its appearance in the company facts API.
+    """
+    marks = marks.set_index('cik')
+    new_ciks = [cik for cik in ciks if cik not in marks.index]
+    no_filings = pd.Series(dtype='datetime64[ns]')
 
-        # 1) assemble all of the tickers
-        tickers = ','.join(ticker_cik_refs.loc[
-                        ticker_cik_refs['cik'] == cik,
-                        'ticker'
-                ])
+    since = marks['filing_date'].max() - pd.Timedelta(days=since_days)
+    if pd.isna(since):
+        return list(ciks), no_filings
+    filings = get_filings(form='10-K', amendments=False, filing_date=f'{since:%Y-%m-%d}:')
+    if filings is None:
+        return new_ciks, no_filings
 
-        # market data reported on the 10-K
-        public_float = query().by_concept('dei:EntityPublicFloat').to_dataframe()
-        public_float = clean_and_dedup_data(public_float)
+    index = filings.data.select(['cik', 'filing_date']).to_pandas()
+    index['filing_date'] = pd.to_datetime(index['filing_date'])
+    latest = index.groupby('cik')['filing_date'].max()
 
-        shares_outstanding = query().by_concept('dei:EntityCommonStockSharesOutstanding').to_dataframe()
-        shares_outstanding = clean_and_dedup_data(shares_outstanding)
+    known = [cik for cik in ciks if cik in marks.index and cik in latest.index]
+    mark = marks.loc[known, 'filing_date']
+    # no mark: never checked against the filing index (see incremental_update), any 10-K counts as new
+    updated = mark.isna() | (latest.loc[known].to_numpy() > mark)
 
-        # other data
-        financials_data = query().by_period_type(PeriodType.ANNUAL).to_dataframe()
-        financials_data = clean_and_dedup_data(financials_data)
+    updated = set(mark.index[updated]) | set(new_ciks)
+    return [cik for cik in ciks if cik in updated], latest
 
-        # balance sheets data is not period type annual
-        balance_data = query().by_statement_type("BalanceSheet").to_dataframe()
-        balance_data = clean_and_dedup_data(balance_data)
 
-        data = pd.concat([public_float, shares_outstanding, financials_data, balance_data])
-        data['cik'] = cik
-        data['tickers'] = tickers
-        data['company'] = company.name
+def incremental_update(file_name='fetched.parquet', workers=1, company_cls=Company, limiter=None,
+                       cache=None, raw_dir=RAW_FACTS):
+    """Refetch only the companies that filed a new 10-K and merge them into `file_name`
 
-        all_data.append(data)
+    Each changed company is refetched in full and replaces its old rows, so the
+    per-company `clean_and_dedup_data` pass sees its whole history exactly as in a
+    full run. Companies that lost their ticker are dropped, as a full run would.
+    """
+    ciks = build_ticker_index(reference.tickers.get_cik_tickers())['cik'].tolist()
+
+    marks = pd.read_parquet(marks_path(file_name))
+    changed, latest = changed_companies(marks, ciks)
+    print(f'{len(changed)} of {len(ciks)} companies have new 10-K filings')
+    if not changed:
+        return changed
+
+    if cache is not None:
+        for cik in changed:
+            cache.invalidate(cache.make_key('get_facts', cik))
+
+    update_file = Path(file_name).with_suffix('.update.parquet')
+    update_file.unlink(missing_ok=True)  # left by an interrupted merge: its companies are refetched
+    selected_datapoints(update_file, workers, company_cls, limiter, ciks=changed, cache=cache, raw_dir=raw_dir)
+
+    # merge: unchanged companies from the existing dataset, changed ones from the update (if any has facts)
+    data = pq.read_table(file_name, filters=~pc.field('cik').isin(changed)).to_pandas()
+    if update_file.exists():
+        data = pd.concat([data, pd.read_parquet(update_file)])
+        update_file.unlink()
+    data = data[data['cik'].isin(ciks)]
+    order = pd.Series(range(len(ciks)), index=ciks)
+    data = data.iloc[order.loc[data['cik']].argsort(kind='stable')]
+    data.to_parquet(file_name, index=False)
+
+    # still no 10-K facts: marked with the filing that got them refetched, so only a newer one does again
+    update_marks = pd.read_parquet(marks_path(update_file))
+    no_facts = update_marks['filing_date'].isna()
+    update_marks.loc[no_facts, 'filing_date'] = update_marks.loc[no_facts, 'cik'].map(latest)
+    marks = pd.concat([marks[~marks['cik'].isin(changed)], update_marks])
+    marks[marks['cik'].isin(ciks)].to_parquet(marks_path(file_name), index=False)
+
+    marks_path(update_file).unlink()
+    return changed
+
+
+def rebuild_datapoints(file_name='fetched.parquet', raw_dir=RAW_FACTS, processes=None, ciks=None):
+    """Regenerate `file_name` from the raw layer, without a single request to EDGAR
+
+    Reruns the cleaning of `fetch_company` on the stored 10-K facts, one process
+    per CIK bucket at a time, for the companies of the last fetched ticker index
+    (or `ciks`), in the same order as a fetch.
+    """
+    if ciks is None:
+        ciks = load_ticker_index()['cik'].tolist()
+    # bucket files left by a crashed run would be merged into this one
+    parts_dir = Path(file_name).with_suffix('.rebuild')
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    parts_dir.mkdir()
+
+    # spawned, not forked: polars' thread pool does not survive a fork of a process that used it
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(rebuild_bucket, raw_dir, n, parts_dir / f'bucket-{n:02d}.parquet')
+                   for n in range(BUCKETS)]
+        for future in track(as_completed(futures), total=len(futures), description='buckets'):
+            future.result()
+
+    tables = [pq.read_table(path) for path in sorted(parts_dir.glob('bucket-*.parquet'))]
+    if not tables:
+        raise ValueError(f'no raw facts in {raw_dir}')
+    data = pa.concat_tables(tables, promote_options='permissive')
+    data = data.filter(pc.field('cik').isin(ciks))
+
+    order = pd.Series(range(len(ciks)), index=ciks)
+    data = data.take(order.loc[data['cik'].to_numpy()].to_numpy().argsort(kind='stable'))
+    tmp_path = f'{file_name}.tmp'
+    pq.write_table(data, tmp_path)
+    os.replace(tmp_path, file_name)
+    shutil.rmtree(parts_dir)
+
+
+def rebuild_bucket(raw_dir, n, path):
+    """worker process entry point for rebuild_datapoints: cleans the companies of one bucket in one polars pass"""
+    raw = read_bucket(raw_dir, n)
+    if raw is None:
+        return
+    # the subsets and cleaning of extract_datapoints, for all the bucket's companies at once
+    parts = datapoint_subsets(raw)
+    stacked = pd.concat([part.assign(_subset=i) for i, part in enumerate(parts)])
+    data = clean_and_dedup_polars(pl.from_arrow(pa.Table.from_pandas(stacked, preserve_index=False)),
+                                  by=('cik', '_subset')).drop('_subset')
+
+    # an empty subset of a company is concatenated uncleaned, see extract_datapoints:
+    # it adds its raw columns and widens the column types as an empty pandas frame would
+    subsets = stacked.groupby('cik')['_subset'].nunique()
+    if len(subsets) < raw['cik'].nunique() or (subsets < len(parts)).any():
+        empty = pl.from_arrow(pa.Table.from_pandas(raw.iloc[:0], preserve_index=False))
+        data = pl.concat([data, empty], how='diagonal_relaxed')
+    data.write_parquet(path)
+
+
+def fetch_company(cik, tickers, company_cls=Company, limiter=None, cache=None, raw_facts=None):
+    """Fetch and clean the 10-K datapoints of a single company
+
+    `tickers` are the company's comma-joined ticker symbols.
+    The uncleaned facts are also handed to `raw_facts`, a `RawFactsWriter`, when given.
+    Returns the company's data and its latest 10-K (filing_date, accession),
+    both None when facts are not available.
+    """
+    limiter = limiter or RateLimiter()
 
-    pd.concat(all_data).to_parquet(file_name, index=False)
+    company = company_cls(cik)
+    facts = edgar_cache.get_facts(company, cache,
+                                  fetch=lambda: call_with_backoff(company.get_facts, limiter))
 
+    if facts is None:  # make sure the data is available
+        return None, None
 
-def clean_and_dedup_data(df):
+    # all 10-K facts, materialized once
+    tenk = facts.query().by_form_type('10-K').to_dataframe()
+
+    # high-water mark for incremental updates
+    filed = tenk.dropna(subset=['filing_date'])
+    latest = max(zip(filed['filing_date'], filed['accession']), default=None)
+
+    # company name comes from the submissions endpoint: one more request
+    name = edgar_cache.company_name(
+        company, cache, fetch=lambda: call_with_backoff(lambda: company.name, limiter))
+    if raw_facts is not None:
+        raw_facts.add(cik, tenk, tickers, name)
+
+    return company_datapoints(tenk, cik, tickers, name), latest
+
+
+def company_datapoints(tenk, cik, tickers, name):
+    """the rows fetch_company returns for a company's 10-K facts"""
+    data = extract_datapoints(tenk)
+    data['cik'] = cik
+    data['tickers'] = tickers
+    data['company'] = name
+    return data
+
+
+def extract_datapoints(tenk):
+    """Market data, annual and balance sheet datapoints from a company's 10-K facts
+
+    Same result as running the four FactQuery filters below separately and cleaning
+    each with `clean_and_dedup_data`, but derives the subsets with masks over one
+    frame and cleans them together in a single pass.
+    """
+    parts = datapoint_subsets(tenk)
+    stacked = pd.concat([part.assign(_subset=i) for i, part in enumerate(parts)])
+    data = clean_and_dedup_data(stacked, by=['_subset'])
+
+    if any(part.empty for part in parts):
+        # an empty subset is left uncleaned and keeps its raw columns, as when
+        # the subsets were cleaned and concatenated one by one
+        return pd.concat([part if part.empty else data[data['_subset'] == i].drop(columns='_subset')
+                          for i, part in enumerate(parts)])
+    return data.drop(columns='_subset')
+
+
+def datapoint_subsets(tenk):
+    """the rows of the four FactQuery filters of `extract_datapoints`; row-wise, so `tenk` can hold many companies"""
+    concept = tenk['concept'].str.lower()
+    label = tenk['label'].str.lower()
+
+    def by_concept(name):
+        # FactQuery.by_concept: case-insensitive match on the concept or its label
+        return concept.str.contains(name, regex=False) | label.str.contains(name, regex=False).fillna(False)
+
+    def by_period_type_annual():
+        # FactQuery.by_period_type(PeriodType.ANNUAL): durations of 11 to 13 calendar months
+        start = pd.to_datetime(tenk['period_start'])
+        end = pd.to_datetime(tenk['period_end'])
+        months = (end.dt.year - start.dt.year) * 12 + end.dt.month - start.dt.month + 1
+        return start.notna() & (tenk['period_type'] == 'duration') & ((months - 12).abs() <= 1)
+
+    return [
+        # market data reported on the 10-K
+        tenk[by_concept('dei:entitypublicfloat')],
+        tenk[by_concept('dei:entitycommonstocksharesoutstanding')],
+        # other data
+        tenk[by_period_type_annual()],
+        # balance sheets data is not period type annual
+        tenk[tenk['statement_type'] == 'BalanceSheet'],
+    ]
+
+
+def clean_and_dedup_data(df, by=()):
     """ cleaning and de-duplicating rows.
 
     There are a couple of things happening at the same time:
@@ -77,6 +556,7 @@ def clean_and_dedup_data(df):
     2) the _first_ statement that we have report non-duplicated information
         from earlier years
 
+    Rows are only compared within groups of the `by` columns.
     """
     if len(df) == 0:
         return df
@@ -85,16 +565,17 @@ def clean_and_dedup_data(df):
 
     # hard remove any duplicated concept, value, period_ends
     # note: this breaks the fiscal_year encoding
-    df = df.drop_duplicates(subset=['concept', 'value', 'period_end'])
+    by = list(by)
+    df = df.drop_duplicates(subset=[*by, 'concept', 'value', 'period_end'])
 
     # genuine multiply reported values: 
     # Take the one that has more significant figures (frequently casuse mismatches)
     # Tie break with reported year (bigger is better)
 
-    df['precision_score'] = df['value'].fillna(0).astype(str).str.rstrip('0.').str.len()
-    df_sorted = df.sort_values(by=['concept', 'period_end', 'precision_score',
+    df['precision_score'] = significant_digits(df['value'].to_numpy())
+    df_sorted = df.sort_values(by=[*by, 'concept', 'period_end', 'precision_score',
                                    'fiscal_year'])
-    df = df_sorted.drop_duplicates(subset=['concept', 'period_end'], keep='last')
+    df = df_sorted.drop_duplicates(subset=[*by, 'concept', 'period_end'], keep='last')
 
     # set fiscal_year based on end date
     years_ended = df['period_end'].dt.year
@@ -104,3 +585,158 @@ def clean_and_dedup_data(df):
     df = df.drop(columns=['accession', 'filing_date', 'precision_score'])
 
     return df
+
+
+def clean_and_dedup_polars(frame, by=('cik',)):
+    """ clean_and_dedup_data for many companies at once, in polars
+
+    Takes a polars DataFrame or LazyFrame holding several companies (or whole
+    datasets) and dedups within groups of `by`; returns the same kind of frame.
+    The rows of each group are those of the pandas version with the same `by`,
+    in the same order; groups come out sorted by `by`.
+    """
+    by = list(by)
+    lazy = (
+        frame.lazy()
+        .with_columns(pl.col('period_end').cast(pl.Datetime('us')))
+        .unique(subset=[*by, 'concept', 'value', 'period_end'], keep='first', maintain_order=True)
+        .with_columns(precision_score=pl.col('value').map_batches(
+            lambda values: pl.Series(significant_digits(values.to_numpy())), return_dtype=pl.Int64))
+        .sort([*by, 'concept', 'period_end', 'precision_score', 'fiscal_year'], nulls_last=True, maintain_order=True)
+        .unique(subset=[*by, 'concept', 'period_end'], keep='last', maintain_order=True)
+        .with_columns(fiscal_year=pl.col('period_end').dt.year())
+        .drop('accession', 'filing_date', 'precision_score', strict=False)
+    )
+    return lazy if isinstance(frame, pl.LazyFrame) else lazy.collect()
+
+
+# 10**0 ... 10**308: digit counts by binary search
+POWERS_OF_TEN = 10.0 ** np.arange(309)
+MAX_DECIMALS = 15
+
+
+def significant_digits(values):
+    """ number of significant digits of each value
+
+    Sign, decimal point, leading and trailing zeros do not count, so 1000.5 and
+    10005 both have 5 and 1200000 has 2. Zero and NaN have none.
+    """
+    magnitudes = np.abs(np.nan_to_num(np.asarray(values, dtype='float64'), nan=0.0, posinf=0.0, neginf=0.0))
+    x = magnitudes.copy()
+
+    # shift the decimal point right until every value is whole: the input is
+    # compared exactly, a shifted value is within an ulp of its decimal digits
+    pending = np.flatnonzero(x != np.round(x))
+    for decimals in range(1, MAX_DECIMALS + 1):
+        if pending.size == 0:
+            break
+        shifted = x[pending] = magnitudes[pending] * POWERS_OF_TEN[decimals]
+        pending = pending[np.abs(shifted - np.round(shifted)) > np.spacing(shifted)]
+    x = np.round(x)
+
+    # then drop trailing zeros
+    pending = np.flatnonzero((x > 0) & (np.fmod(x, 10) == 0))
+    while pending.size:
+        x[pending] /= 10
+        pending = pending[np.fmod(x[pending], 10) == 0]
+
+    return np.searchsorted(POWERS_OF_TEN, x, side='right')
+
+
+class WorkerProgress:
+    """rich progress display: an overall bar with companies/sec, and one row per worker"""
+    def __init__(self, total):
+        self.total = total
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.progress = Progress(
+            TextColumn('{task.description}'),
+            BarColumn(),
+            MofNCompleteColumn(),
+            TextColumn('{task.fields[rate]}'),
+            TimeRemainingColumn(),
+        )
+
+    def __enter__(self):
+        self.progress.start()
+        self.started = time.monotonic()
+        self.overall = self.progress.add_task('all companies', total=self.total, rate='')
+        return self
+
+    def __exit__(self, *exc):
+        self.progress.stop()
+
+    def _worker_task(self):
+        """progress row owned by the calling worker thread"""
+        task = getattr(self.local, 'task', None)
+        if task is None:
+            with self.lock:
+                task = self.progress.add_task('worker', total=None, rate='')
+            self.local.task = task
+        return task
+
+    def wrap(self, fetch):
+        def tracked(cik):
+            task = self._worker_task()
+            self.progress.update(task, description=f'worker {task}: CIK {cik}')
+            data = fetch(cik)
+            self.progress.advance(task)
+            return data
+        return tracked
+
+    def report(self, done):
+        rate = done / (time.monotonic() - self.started)
+        self.progress.update(self.overall, completed=done, rate=f'{rate:.1f} companies/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fetch 10-K datapoints from EDGAR')
+    parser.add_argument('--file-name', default='fetched.parquet')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--incremental', action='store_true',
+                        help='only refetch companies that filed a new 10-K since the last run')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='split the fetch over this many processes (0: one per core)')
+    parser.add_argument('--no-cache', action='store_true', help='bypass the local EDGAR response cache')
+    parser.add_argument('--queue', default=None,
+                        help='job queue file to drain; start one worker process per run, on any host sharing it')
+    parser.add_argument('--status', action='store_true', help='report the progress of --queue and exit')
+    parser.add_argument('--merge', action='store_true', help='write --file-name from a drained --queue')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='give the dead-lettered jobs of --queue a fresh retry budget, then drain it')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='regenerate --file-name from the raw facts layer instead of fetching')
+    parser.add_argument('--no-raw', action='store_true', help='do not keep the raw 10-K facts')
+    parser.add_argument('--rate', type=float, default=SEC_MAX_REQUESTS_PER_SECOND,
+                        help='requests per second (shared by all shards); split it between queue workers')
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else edgar_cache.EdgarCache()
+    limiter = RateLimiter(rate=args.rate)
+    raw_dir = None if args.no_raw else RAW_FACTS
+
+    if args.rebuild:
+        rebuild_datapoints(args.file_name)
+    elif args.queue is not None:
+        queue = JobQueue(args.queue)
+        parts_dir = Path(args.file_name).with_suffix('.parts')
+        if args.status:
+            print(format_status(queue.status()))
+        elif args.merge:
+            merge_queue(queue, parts_dir, args.file_name)
+        else:
+            if args.retry_failed:
+                print(f'{queue.retry_failed()} failed companies queued again')
+            queue.enqueue(build_ticker_index(reference.tickers.get_cik_tickers())['cik'])
+            queue_worker(queue, parts_dir, args.workers, limiter=limiter, cache=cache, raw_dir=raw_dir)
+    elif args.incremental:
+        incremental_update(args.file_name, args.workers, limiter=limiter, cache=cache, raw_dir=raw_dir)
+    elif args.shards is not None:
+        cache_dir = None if args.no_cache else cache.directory
+        sharded_datapoints(args.file_name, args.shards or None, args.workers, cache_dir=cache_dir,
+                           rate=args.rate, raw_dir=raw_dir)
+    else:
+        selected_datapoints(args.file_name, args.workers, limiter=limiter, cache=cache, raw_dir=raw_dir)
+
+    if cache is not None:
+        print(f'EDGAR cache: {cache.stats}, hit rate {cache.hit_rate():.0%}')
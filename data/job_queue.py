@@ -0,0 +1,160 @@
+# SQLite-backed job table for long universe fetches
+import socket
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    """Per-CIK fetch jobs shared by any number of worker processes
+
+    Workers lease pending jobs for `lease_seconds`; a job whose worker died or hung
+    is handed back once its lease runs out, as a failed attempt. Failed jobs are
+    retried with exponential backoff, and after `max_attempts` they are parked as
+    FAILED: the dead-letter list.
+    Several hosts can drain one queue through a shared filesystem, as far as
+    that filesystem honours SQLite's file locks.
+    """
+    def __init__(self, path, lease_seconds=600, max_attempts=5, backoff_seconds=30):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                               cik INTEGER PRIMARY KEY,
+                               position INTEGER NOT NULL,
+                               state TEXT NOT NULL,
+                               attempts INTEGER NOT NULL DEFAULT 0,
+                               worker TEXT,
+                               lease_until REAL,
+                               not_before REAL NOT NULL DEFAULT 0,
+                               finished REAL,
+                               error TEXT)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, not_before)')
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT: takes the write lock up front, so reads and writes inside see no other writer
+
+        The connection is in autocommit mode, where `with self.db` does not open a transaction.
+        """
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.db
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def worker_id():
+        return f'{socket.gethostname()}-{os.getpid()}'
+
+    def enqueue(self, ciks):
+        """Add jobs for new CIKs, in order; existing jobs are left alone"""
+        with self.transaction():
+            start = self.db.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM jobs').fetchone()[0]
+            self.db.executemany(
+                'INSERT OR IGNORE INTO jobs (cik, position, state) VALUES (?, ?, ?)',
+                [(int(cik), start + i, PENDING) for i, cik in enumerate(ciks)],
+            )
+
+    def lease(self, worker, n=1):
+        """Claim up to `n` runnable jobs for `worker`, in queue order"""
+        now = time.time()
+        with self.transaction():
+            self._expire_leases(now)
+            ciks = [row[0] for row in self.db.execute(
+                'SELECT cik FROM jobs WHERE state = ? AND not_before <= ? ORDER BY position LIMIT ?',
+                (PENDING, now, n),
+            )]
+            self.db.executemany(
+                'UPDATE jobs SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1 WHERE cik = ?',
+                [(RUNNING, worker, now + self.lease_seconds, cik) for cik in ciks],
+            )
+        return ciks
+
+    def _expire_leases(self, now):
+        """Fail the jobs whose lease ran out, with fail()'s backoff and dead-lettering; call in a transaction"""
+        error = "'lease of ' || worker || ' expired'"
+        self.db.execute(f'UPDATE jobs SET state = ?, finished = ?, lease_until = NULL, error = {error} '
+                        'WHERE state = ? AND lease_until < ? AND attempts >= ?',
+                        (FAILED, now, RUNNING, now, self.max_attempts))
+        self.db.execute(f'UPDATE jobs SET state = ?, not_before = ? + ? * (1 << (attempts - 1)), lease_until = NULL, '
+                        f'error = {error} WHERE state = ? AND lease_until < ?',
+                        (PENDING, now, self.backoff_seconds, RUNNING, now))
+
+    def complete(self, ciks, worker):
+        """Mark jobs done, unless their lease has since passed to another worker"""
+        now = time.time()
+        with self.transaction():
+            self.db.executemany(
+                'UPDATE jobs SET state = ?, finished = ?, lease_until = NULL, error = NULL '
+                'WHERE cik = ? AND state = ? AND worker = ?',
+                [(DONE, now, int(cik), RUNNING, worker) for cik in ciks],
+            )
+
+    def fail(self, cik, worker, error):
+        """Schedule a retry with exponential backoff, or dead-letter the job"""
+        now = time.time()
+        with self.transaction():
+            row = self.db.execute('SELECT attempts FROM jobs WHERE cik = ? AND state = ? AND worker = ?',
+                                  (int(cik), RUNNING, worker)).fetchone()
+            if row is None:
+                return
+            attempts = row[0]
+            if attempts >= self.max_attempts:
+                self.db.execute('UPDATE jobs SET state = ?, finished = ?, lease_until = NULL, error = ? '
+                                'WHERE cik = ? AND state = ? AND worker = ?',
+                                (FAILED, now, error, int(cik), RUNNING, worker))
+            else:
+                delay = self.backoff_seconds * 2 ** (attempts - 1)
+                self.db.execute('UPDATE jobs SET state = ?, not_before = ?, lease_until = NULL, error = ? '
+                                'WHERE cik = ? AND state = ? AND worker = ?',
+                                (PENDING, now + delay, error, int(cik), RUNNING, worker))
+
+    def retry_failed(self):
+        """Move dead-lettered jobs back to pending with a fresh retry budget; returns how many"""
+        with self.transaction():
+            return self.db.execute('UPDATE jobs SET state = ?, attempts = 0, not_before = 0 WHERE state = ?',
+                                   (PENDING, FAILED)).rowcount
+
+    def dead_letters(self):
+        """(cik, attempts, error) of the jobs that ran out of retries"""
+        return self.db.execute('SELECT cik, attempts, error FROM jobs WHERE state = ? ORDER BY position',
+                               (FAILED,)).fetchall()
+
+    def done_by(self):
+        """CIK -> worker that completed it, in queue order"""
+        return dict(self.db.execute('SELECT cik, worker FROM jobs WHERE state = ? ORDER BY position', (DONE,)))
+
+    def is_drained(self):
+        row = self.db.execute('SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)', (PENDING, RUNNING)).fetchone()
+        return row[0] == 0
+
+    def next_retry(self):
+        """seconds until the earliest backed-off job becomes runnable, None if there is none"""
+        row = self.db.execute('SELECT MIN(not_before) FROM jobs WHERE state = ?', (PENDING,)).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def status(self, window_seconds=600):
+        """Job counts per state, recent throughput (jobs/s) and an ETA in seconds"""
+        counts = dict.fromkeys([PENDING, RUNNING, DONE, FAILED], 0)
+        counts.update(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+
+        now = time.time()
+        recent = self.db.execute('SELECT COUNT(*), MIN(finished) FROM jobs WHERE state IN (?, ?) AND finished >= ?',
+                                 (DONE, FAILED, now - window_seconds)).fetchone()
+        throughput = recent[0] / (now - recent[1]) if recent[0] > 1 else 0.0
+        remaining = counts[PENDING] + counts[RUNNING]
+        eta = remaining / throughput if throughput else None
+        return {**counts, 'throughput': throughput, 'eta': eta}
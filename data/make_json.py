@@ -1,14 +1,19 @@
 import polars as pl
 import json
 
+from ticker_index import TICKER_INDEX
 
-def make_commands_json():
-    data = pl.read_parquet('data/sheets.parquet')
 
-    # ticker to company translation
-    pairs = data[['company', 'tickers']]
-    pairs = pairs.with_columns(tickers=pl.col('tickers').str.split(','))
-    pairs = pairs.explode('tickers').unique().drop_nulls()
+def make_commands_json():
+    data = pl.read_parquet('data/sheets.parquet', columns=['fiscal_year'])
+    companies = pl.read_parquet('data/companies.parquet', columns=['cik', 'company'])
+
+    # ticker to company translation, through the CIK -> tickers index written by fetch_data.py
+    pairs = companies.join(
+        pl.read_parquet(TICKER_INDEX).with_columns(pl.col('cik').cast(companies['cik'].dtype)),
+        on='cik',
+    )
+    pairs = pairs.select('company', 'tickers').explode('tickers').unique().drop_nulls()
     ticker_to_company = dict(pairs.group_by('tickers').agg(pl.col("company")).iter_rows())
 
     companies = pairs['company'].unique().drop_nulls().sort()
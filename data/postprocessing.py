@@ -1,24 +1,42 @@
 # cleaning and formatting the assembled datasheets 
+import argparse
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from checkpoint import unified_schema
+from distributions import value_distributions
+from raw_facts import BUCKETS
 
 
-def basic_cleaning(df):
+def basic_cleaning(df, relabel=None):
+    """ `relabel` (see `relabeling`) is computed from df when not given """
     # set the types
     df['fiscal_year'] = df['fiscal_year'].astype(int)
-    df['period_start'] = pd.to_datetime(df['period_start'], unit='s')
-    df['period_end'] = pd.to_datetime(df['period_end'], unit='s')
+    df['period_start'] = pd.to_datetime(df['period_start'], unit='s').astype('datetime64[ms]')
+    df['period_end'] = pd.to_datetime(df['period_end'], unit='s').astype('datetime64[ms]')
 
     # handle overlapping labels:
     # rename concepts with overlapping labels that differ only in prefix 
-    concepts_by_label = df.groupby('label')['concept']
+    if relabel is None:
+        relabel = relabeling(df[['label', 'concept']])
 
-    for concepts in concepts_by_label.unique()[(concepts_by_label.nunique() > 1)]:
-        if len(concepts) == 2:
-            for old_name in concepts:
-                prefix, name = old_name.split(':')
-                if prefix == 'srt':
-                    new_name = 'us-gaap:' + name
-                    df.loc[df['concept'] == old_name, 'concept'] = new_name
+    # renamed on the categories: one pass over the rows, whatever the number of renames
+    concepts = df['concept'].astype('category')
+    renamed = concepts.cat.categories.to_series().replace(relabel)
+    categories = pd.Index(renamed.unique()).sort_values()
+    codes = concepts.cat.codes.to_numpy()
+    # code -1 is a missing concept, which must not index the last category
+    df['concept'] = pd.Categorical.from_codes(np.where(codes == -1, -1, categories.get_indexer(renamed)[codes]),
+                                              categories)
 
     # more deduplication: now on the fiscal year
     # same value duplicates
@@ -28,16 +46,155 @@ def basic_cleaning(df):
     df_sorted = df.sort_values(by=['concept', 'cik', 'fiscal_year', 'period_end'])
     df = df_sorted.drop_duplicates(subset=['concept', 'fiscal_year', 'cik'], keep='last')
 
+    df['concept'] = df['concept'].astype(str)
     return df
 
 
-def concept_filtering(df, threashold=0.95):
+def relabeling(pairs):
+    """ old -> new concept names for srt: concepts sharing their label with exactly one other concept
+
+    `pairs` has label and concept columns, duplicates allowed. A missing concept
+    counts towards the concepts of its label, but is never one of the two.
+    """
+    pairs = pairs[['label', 'concept']].dropna(subset=['label']).drop_duplicates()
+    by_label = pairs.groupby('label')['concept']
+    overlapping = (by_label.transform('size') == 2) & (by_label.transform('count') == 2)
+    old_names = pairs.loc[overlapping & pairs['concept'].str.startswith('srt:'), 'concept'].unique()
+    return dict(zip(old_names, 'us-gaap:' + pd.Series(old_names, dtype=str).str.split(':').str[1]))
+
+
+def basic_cleaning_lazy(frame, relabel=None, concepts=None):
+    """ basic_cleaning as a polars query that runs on the streaming engine
+
+    Takes a LazyFrame (e.g. from `pl.scan_parquet`). Same rows in the same
+    order as the pandas version, with the dates in milliseconds as there.
+    `relabel` is the result of `srt_relabeling` (computed when not given), and
+    `concepts` restricts the query to those (relabelled) concepts.
+    """
+    if relabel is None:
+        relabel = srt_relabeling(frame)
+
+    # row numbers stand in for the order pandas keeps and breaks ties by
+    frame = frame.with_row_index('_row')
+    if concepts is not None:
+        # filter on the names as stored, so that it is pushed down into the scan
+        concepts = set(concepts)
+        concepts.update(old for old, new in relabel.items() if new in concepts)
+        keep = pl.col('concept').is_in([concept for concept in concepts if concept is not None])
+        frame = frame.filter(keep | pl.col('concept').is_null() if None in concepts else keep)
+
+    frame = frame.with_columns(
+        pl.col('concept').replace(relabel),
+        pl.col('fiscal_year').cast(pl.Int64),
+        pl.col('period_start').cast(pl.Datetime('ms')),
+        pl.col('period_end').cast(pl.Datetime('ms')),
+    )
+
+    # same value duplicates: keep the first
+    frame = frame.join(
+        frame.group_by(['concept', 'fiscal_year', 'cik', 'value']).agg(pl.col('_row').min()),
+        on='_row', how='semi',
+    )
+
+    # tie break by later period-end date, undated rows last as in pandas ...
+    keys = ['concept', 'fiscal_year', 'cik']
+    frame = frame.with_columns(_period_end=pl.col('period_end').fill_null(pl.datetime(9999, 12, 31)))
+    frame = frame.join(frame.group_by(keys).agg(pl.col('_period_end').max()),
+                       on=[*keys, '_period_end'], how='semi', nulls_equal=True)
+    # ... then by the later row: the row a stable sort would have put last
+    frame = frame.join(frame.group_by(keys).agg(pl.col('_row').max()), on='_row', how='semi')
+
+    return frame.sort(['concept', 'cik', 'fiscal_year'], nulls_last=True).drop('_row', '_period_end')
+
+
+def srt_relabeling(frame):
+    """ old -> new concept names for srt: concepts sharing their label with exactly one other concept
+    """
+    relabel = (
+        frame
+        .drop_nulls('label')
+        .group_by('label')
+        .agg(pl.col('concept').unique())
+        .filter(pl.col('concept').list.len() == 2, pl.col('concept').list.drop_nulls().list.len() == 2)
+        .explode('concept')
+        .filter(pl.col('concept').str.starts_with('srt:'))
+        .select(pl.col('concept').unique())
+        .collect(engine='streaming')
+        .get_column('concept')
+    )
+    return dict(zip(relabel, 'us-gaap:' + relabel.str.split(':').list.get(1)))
+
+
+def basic_cleaning_parquet(source, destination, partitions=8):
+    """ basic_cleaning from one parquet file to another, for datasets larger than memory
+
+    Both deduplications are within a concept, so the data is cleaned one range
+    of concepts at a time, holding about 1/`partitions` of it in memory. The
+    ranges are written out in concept order: the same file as a single pass.
+    """
+    frame = pl.scan_parquet(source)
+    relabel = srt_relabeling(frame)
+
+    counts = (
+        frame
+        .select(pl.col('concept').replace(relabel))
+        .group_by('concept')
+        .len()
+        .sort('concept', nulls_last=True)
+        .collect(engine='streaming')
+    )
+    # contiguous concept ranges with about the same number of rows
+    part = (counts['len'].cum_sum() - counts['len']) * partitions // counts['len'].sum()
+
+    parts_dir = Path(destination).with_suffix('.parts')
+    parts_dir.mkdir(exist_ok=True)
+    paths = []
+    for i in range(partitions):
+        concepts = counts.filter(part == i)['concept']
+        if len(concepts):
+            paths.append(parts_dir / f'part-{i:03d}.parquet')
+            basic_cleaning_lazy(frame, relabel, concepts).sink_parquet(paths[-1])
+
+    pl.scan_parquet(paths).sink_parquet(destination)
+    shutil.rmtree(parts_dir)
+
+
+def concept_sparsity(df):
+    """ share of the (cik, fiscal_year) pairs without a value, for each concept
+
+    Counted from the long format: no (cik, fiscal_year) x concept matrix.
+    Indexed by concept, in sorted order.
+    """
+    pairs = len(df[['cik', 'fiscal_year']].drop_duplicates())
+    counts = df['value'].notna().groupby(df['concept']).sum()
+    return ((pairs - counts) / pairs).rename(None)
+
+
+def concept_sparsity_lazy(frame):
+    """ concept_sparsity of a polars LazyFrame, as a pandas Series; runs on the streaming engine
+    """
+    pairs = frame.select(pl.struct('cik', 'fiscal_year').n_unique()).collect(engine='streaming').item()
+    value = pl.col('value')
+    counts = (
+        frame
+        .group_by('concept')
+        .agg((value.is_not_null() & value.is_not_nan()).sum().cast(pl.Int64).alias('count'))
+        .sort('concept')
+        .collect(engine='streaming')
+    )
+    counts = pd.Series(counts['count'].to_numpy(), index=pd.Index(counts['concept'].to_list(), name='concept'))
+    return (pairs - counts) / pairs
+
+
+def concept_filtering(df, threashold=0.95, sparsity=None):
     """ filter concepts: most concepts appear for less than 5% of companies
+
+    `sparsity` can be given when already computed, e.g. by concept_sparsity_lazy.
     """
-    concept_data = df.pivot(index=['cik', 'fiscal_year'], columns='concept', values='value')
-    concept_sparsity = concept_data.isna().mean()
+    if sparsity is None:
+        sparsity = concept_sparsity(df)
 
-    common_concepts = concept_data.columns[concept_sparsity < threashold]
+    common_concepts = sparsity.index[sparsity < threashold]
     df = df[df['concept'].isin(common_concepts)]
 
     # Make labels for concepts that have none
@@ -48,19 +205,483 @@ def concept_filtering(df, threashold=0.95):
                                                          regex=True)
 
     # also return concepts and labels sorted by frequency
+    return df, concept_metadata(df, sparsity, threashold)
+
+
+def concept_labels_lazy(frame):
+    """ the labelling of concept_filtering for a polars frame: concepts without a label get one from their name """
+    name = pl.col('concept').str.split(':').list.get(1, null_on_oob=True).str.replace_all(r'([a-z])([A-Z])', '$1 $2')
+    return frame.with_columns(pl.when(pl.col('label') == '').then(name).otherwise(pl.col('label')).alias('label'))
+
+
+def concept_metadata(df, sparsity, threashold=0.95):
+    """ the common concepts, by sparsity, with their labels and statement types in df """
     concept_labels = df[['concept', 'label', 'statement_type']].drop_duplicates()
-    sparsity_df = pd.DataFrame(concept_sparsity[concept_sparsity < threashold].sort_values()
+    sparsity_df = pd.DataFrame(sparsity[sparsity < threashold].sort_values()
                                ).reset_index()
     metadata = pd.merge(sparsity_df, concept_labels, on='concept', how='left')
     metadata = metadata
 
-    return df, metadata
+    return metadata
 
 
-if __name__ == '__main__':
-    data = pd.read_parquet('fetched.parquet')
-    data = basic_cleaning(data)
-    data, metadata = concept_filtering(data)
+# sheets data partitioned by fiscal year, for readers that filter on year, label and cik
+SHEETS_DATASET = 'sheets'
+ROW_GROUP_SIZE = 32_768
+
+
+def write_sheets_dataset(table, directory=SHEETS_DATASET, row_group_size=ROW_GROUP_SIZE, years=None):
+    """ write the sheets data as a hive-partitioned dataset: <directory>/fiscal_year=YYYY/part-0.parquet
+
+    Within a year rows are sorted by label, then cik, in small row groups: the
+    min/max statistics of the label column let a reader skip every row group
+    without one of the labels it asks for. cik gets bloom filters and all
+    columns a page index, for readers that use them.
+    With `years`, only those partitions are rewritten, the others left as they are.
+    Takes the sheets as an arrow Table, see `sheets_table`.
+    """
+    present = pc.unique(table['fiscal_year']).to_pylist()
+
+    tmp_dir = Path(f'{directory}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+    parts = {}
+    for year in sorted(present if years is None else set(years) & set(present)):
+        part = (
+            table
+            .filter(pc.field('fiscal_year') == year)
+            .drop_columns('fiscal_year')
+            .sort_by([('label', 'ascending'), ('cik', 'ascending')])
+        )
+        parts[year] = Path(f'fiscal_year={year}') / 'part-0.parquet'
+        (tmp_dir / parts[year]).parent.mkdir()
+        pq.write_table(
+            part, tmp_dir / parts[year],
+            row_group_size=row_group_size,
+            compression='zstd',
+            write_page_index=True,
+            sorting_columns=pq.SortingColumn.from_ordering(part.schema, [('label', 'ascending'),
+                                                                         ('cik', 'ascending')]),
+            bloom_filter_options={'cik': {'ndv': pc.count_distinct(part['cik']).as_py() or 1}},
+        )
+
+    if years is None:
+        replace_directory(tmp_dir, directory)
+    else:
+        replace_parts(tmp_dir, directory, {year: parts.get(year, Path(f'fiscal_year={year}'))
+                                           for year in years})
+
+
+def sheets_table(df):
+    """ cleaned and filtered sheets data as an arrow Table in the stored schema
+
+    The company columns are left to the companies table (see `company_table`),
+    cik is uint32 and fiscal_year int16. Strings stay strings: parquet already
+    dictionary-encodes them on disk, and polars reads them far faster than categoricals.
+    """
+    table = pa.Table.from_pandas(df.drop(columns=['company', 'tickers']), preserve_index=False)
+    return compact_integers(table.replace_schema_metadata(None))
+
+
+def company_table(df):
+    """ the cik -> company, tickers dimension of the sheets data """
+    companies = df[['cik', 'company', 'tickers']].drop_duplicates('cik').sort_values('cik')
+    table = pa.Table.from_pandas(companies, preserve_index=False).replace_schema_metadata(None)
+    return compact_integers(table)
+
+
+def compact_integers(table):
+    for name, type in [('cik', pa.uint32()), ('fiscal_year', pa.int16())]:
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name, table[name].cast(type))
+    return table
+
+
+# what Yearly Financials shows: one wide table per fiscal year
+WIDE_TABLES = 'wide'
+
+
+def write_wide_tables(table, directory=WIDE_TABLES, years=None):
+    """ write a cik x label table of values per fiscal year: <directory>/<year>.parquet
+
+    Materializes the pivot Yearly Financials used to do on every rerun; being
+    columnar, reading a few label columns only reads those. Company names and
+    tickers are joined from companies.parquet. A label reported under more than
+    one concept by a company keeps the first (by concept) value.
+    Facts without a value are NaN, missing ones null.
+    With `years`, only those tables are rewritten.
+    """
+    # in arrow missing values are null, in the cleaned (pandas) data they were NaN
+    data = (
+        pl.from_arrow(table.select(['fiscal_year', 'cik', 'label', 'value']))
+        .with_columns(pl.col('value').fill_null(float('nan')))
+        .drop_nulls('label')
+    )
+    if years is not None:
+        data = data.filter(pl.col('fiscal_year').is_in(list(years)))
+
+    tmp_dir = Path(f'{directory}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+    for (year,), part in data.partition_by('fiscal_year', as_dict=True).items():
+        wide = part.pivot(on='label', values='value', index='cik',
+                          aggregate_function='first', sort_columns=True)
+        wide.sort('cik').write_parquet(tmp_dir / f'{year}.parquet', compression='zstd')
+
+    if years is None:
+        replace_directory(tmp_dir, directory)
+    else:
+        replace_parts(tmp_dir, directory, {year: Path(f'{year}.parquet') for year in years})
+
+
+DISTRIBUTIONS = 'distributions.parquet'
+
+
+def write_distributions(table, path=DISTRIBUTIONS):
+    """ value statistics per (fiscal_year, label)
+
+    count, min, max and quantiles of the finite values, and `bins`: the non-empty
+    bins (x1, x2, count) of their symlog histogram, which the app's filter
+    histograms draw as they are (components/controls.ColumnControls).
+    The values are those of the wide tables: one per company, label and year.
+    """
+    values = (
+        pl.from_arrow(table.select(['fiscal_year', 'cik', 'label', 'value']))
+        .drop_nulls('label')
+        .unique(['fiscal_year', 'cik', 'label'], keep='first')
+        .filter(pl.col('value').is_finite())
+        .select('fiscal_year', 'label', 'value')
+    )
+    distributions = value_distributions(values, ['fiscal_year', 'label']).sort('label', 'fiscal_year')
+
+    tmp_path = f'{path}.tmp'
+    distributions.write_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def replace_directory(new_dir, directory):
+    """ swap in a freshly written directory for `directory` """
+    old_dir = Path(f'{directory}.old')
+    if Path(directory).exists():
+        os.replace(directory, old_dir)
+    os.replace(new_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
 
-    data.to_parquet('sheets.parquet', index=False)
+
+def replace_parts(new_dir, directory, parts):
+    """ move the parts (relative paths) written to `new_dir` into `directory`; parts not written are removed """
+    for part in parts.values():
+        new, old = new_dir / part, Path(directory) / part
+        if new.exists():
+            old.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(new, old)
+        elif old.is_dir():
+            shutil.rmtree(old)
+        elif old.exists():
+            old.unlink()
+    shutil.rmtree(new_dir)
+
+
+# state kept between runs, so that a refresh of a few companies only cleans those:
+# the cleaned (not yet concept-filtered) data, partitioned by CIK bucket as the raw facts are,
+# and per bucket the (label, concept) pairs behind the srt relabeling and the concept coverage counts
+CLEANED = 'cleaned'
+LABELS = 'cleaned.labels.parquet'
+COVERAGE = 'cleaned.coverage.parquet'
+MARKS = 'cleaned.marks.parquet'
+
+
+def write_cleaned(table, directory=CLEANED):
+    """ write a cleaned arrow Table to <directory>/bucket=N/part-0.parquet, replacing the buckets it has rows in """
+    buckets = pa.array(table['cik'].to_numpy() % BUCKETS, pa.int32())
+    order = pc.sort_indices(buckets)
+    table, buckets = table.take(order), buckets.take(order)
+
+    start = 0
+    for count in pc.value_counts(buckets).to_pylist():
+        path = Path(directory) / f'bucket={count["values"]}' / 'part-0.parquet'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table.slice(start, count['counts']), path, compression='zstd')
+        start += count['counts']
+
+
+def write_cleaned_batches(batches, schema, directory=CLEANED):
+    """ write_cleaned for record batches streamed from a file larger than memory """
+    def with_bucket(batch):
+        buckets = pa.array(batch['cik'].to_numpy() % BUCKETS, pa.int32())
+        return batch.append_column('bucket', buckets)
+
+    ds.write_dataset(
+        (with_bucket(batch) for batch in batches),
+        directory,
+        schema=schema.append(pa.field('bucket', pa.int32())),
+        format='parquet',
+        file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'),
+        partitioning=ds.partitioning(pa.schema([('bucket', pa.int32())]), flavor='hive'),
+        basename_template='part-{i}.parquet',
+        existing_data_behavior='delete_matching',
+        use_threads=False,
+    )
+
+
+def cleaned_files(directory=CLEANED, buckets=None):
+    files = sorted(Path(directory).glob('bucket=*/*.parquet'))
+    if buckets is not None:
+        files = [f for f in files if int(f.parent.name.split('=')[1]) in buckets]
+    return [str(f) for f in files]
+
+
+def read_cleaned(directory=CLEANED, buckets=None, columns=None, filter=None):
+    """ the cleaned data of some (default all) buckets as a pandas DataFrame """
+    files = cleaned_files(directory, buckets)
+    schema = unified_schema(files)
+    table = ds.dataset(files, schema=schema, format='parquet').to_table(columns=columns, filter=filter)
+    return table.to_pandas()
+
+
+def scan_cleaned(directory=CLEANED, buckets=None):
+    """ the cleaned data of some (default all) buckets as a polars LazyFrame """
+    files = cleaned_files(directory, buckets)
+    schema = pl.from_arrow(unified_schema(files).empty_table()).schema
+    return pl.scan_parquet(files, schema=schema, hive_partitioning=False, missing_columns='insert')
+
+
+def label_pairs(frame):
+    """ distinct (bucket, label, concept) of a polars LazyFrame of fetched data """
+    return (
+        frame
+        .select((pl.col('cik') % BUCKETS).cast(pl.Int32).alias('bucket'), 'label', 'concept')
+        .unique()
+        .sort('bucket', 'concept', 'label')
+        .collect(engine='streaming')
+    )
+
+
+def coverage_counts(frame):
+    """ per bucket and concept: the (cik, fiscal_year) pairs with a value (`count`) and in the bucket (`pairs`)
+
+    Summed over buckets these are what concept_sparsity counts, since a CIK is in one bucket only.
+    """
+    frame = frame.with_columns((pl.col('cik') % BUCKETS).cast(pl.Int32).alias('bucket'))
+    value = pl.col('value')
+    counts = frame.group_by('bucket', 'concept').agg(
+        (value.is_not_null() & value.is_not_nan()).sum().cast(pl.Int64).alias('count'))
+    pairs = frame.group_by('bucket').agg(pl.struct('cik', 'fiscal_year').n_unique().cast(pl.Int64).alias('pairs'))
+    return counts.join(pairs, on='bucket').sort('bucket', 'concept').collect(engine='streaming')
+
+
+def coverage_sparsity(coverage):
+    """ concept_sparsity from coverage counts """
+    pairs = coverage.unique('bucket')['pairs'].sum()
+    counts = coverage.group_by('concept').agg(pl.col('count').sum()).sort('concept')
+    counts = pd.Series(counts['count'].to_numpy(), index=pd.Index(counts['concept'].to_list(), name='concept'))
+    return (pairs - counts) / pairs
+
+
+def changed_ciks(old_marks, marks):
+    """ CIKs added, dropped, or with another latest 10-K filing since `old_marks` """
+    merged = old_marks.merge(marks, on='cik', how='outer', suffixes=('_old', ''), indicator=True)
+    changed = merged['_merge'] != 'both'
+    for column in ['filing_date', 'accession']:
+        old, new = merged[f'{column}_old'], merged[column]
+        changed |= ~(old.eq(new) | (old.isna() & new.isna()))
+    return merged.loc[changed, 'cik'].tolist()
+
+
+def postprocess(fetched='fetched.parquet', engine='pandas'):
+    """ clean all of `fetched` and write the outputs along with the state incremental runs start from """
+    shutil.rmtree(CLEANED, ignore_errors=True)
+    if engine == 'polars':
+        basic_cleaning_parquet(fetched, 'cleaned.tmp.parquet')
+        source = pq.ParquetFile('cleaned.tmp.parquet')
+        write_cleaned_batches(source.iter_batches(), source.schema_arrow)
+        Path('cleaned.tmp.parquet').unlink()
+    else:
+        data = basic_cleaning(pd.read_parquet(fetched))
+        write_cleaned(pa.Table.from_pandas(data, preserve_index=False))
+        del data
+
+    label_pairs(pl.scan_parquet(fetched)).write_parquet(LABELS)
+    coverage_counts(pl.scan_parquet(cleaned_files())).write_parquet(COVERAGE)
+    marks = Path(fetched).with_suffix('.marks.parquet')
+    if marks.exists():
+        shutil.copyfile(marks, MARKS)
+
+    write_outputs(engine=engine)
+
+
+def incremental_postprocess(fetched='fetched.parquet'):
+    """ update the outputs for the companies whose fetched data changed since the last run
+
+    Changes are found by comparing the fetch's per-CIK filing marks with those
+    seen last time. Only the CIK buckets holding a changed company are cleaned
+    again, and their coverage counts recounted. When that changes the srt
+    relabeling, which is over all companies, everything is cleaned again.
+    The year partitions of sheets/ and wide/ are only rewritten for the years
+    the changed buckets had or have data in, unless the set of common concepts changed.
+    """
+    marks_file = Path(fetched).with_suffix('.marks.parquet')
+    state = [Path(CLEANED), Path(LABELS), Path(COVERAGE), Path(MARKS), marks_file, Path('metadata.parquet')]
+    if not all(path.exists() for path in state):
+        print('no state from a previous run: cleaning everything')
+        return postprocess(fetched)
+
+    marks = pd.read_parquet(marks_file)
+    changed = changed_ciks(pd.read_parquet(MARKS), marks)
+    print(f'{len(changed)} companies changed since the last run')
+    if not changed:
+        return
+
+    buckets = sorted({cik % BUCKETS for cik in changed})
+    ciks = marks.loc[(marks['cik'] % BUCKETS).isin(buckets), 'cik']
+    data = pd.read_parquet(fetched, filters=pc.field('cik').isin(pa.array(ciks, pa.int64())))
+
+    labels = pl.read_parquet(LABELS)
+    new_labels = pl.concat([labels.filter(~pl.col('bucket').is_in(buckets)),
+                            label_pairs(pl.from_pandas(data).lazy())]).sort('bucket', 'concept', 'label')
+    relabel = relabeling(new_labels.to_pandas())
+    if relabel != relabeling(labels.to_pandas()):
+        print('the srt relabeling changed: cleaning everything')
+        return postprocess(fetched)
+
+    old_files = cleaned_files(buckets=buckets)
+    years = set(read_cleaned(buckets=buckets, columns=['fiscal_year'])['fiscal_year']) if old_files else set()
+    for f in old_files:
+        shutil.rmtree(Path(f).parent, ignore_errors=True)
+    if len(data):
+        data = basic_cleaning(data, relabel)
+        years.update(data['fiscal_year'])
+        write_cleaned(pa.Table.from_pandas(data, preserve_index=False))
+
+    coverage = pl.read_parquet(COVERAGE).filter(~pl.col('bucket').is_in(buckets))
+    files = cleaned_files(buckets=buckets)
+    if files:
+        coverage = pl.concat([coverage, coverage_counts(pl.scan_parquet(files))]).sort('bucket', 'concept')
+
+    previous = set(pd.read_parquet('metadata.parquet', columns=['concept'])['concept'])
+    sparsity = coverage_sparsity(coverage)
+    if set(sparsity.index[sparsity < 0.95]) != previous:
+        print('the common concepts changed: rewriting every year')
+        years = None
+
+    new_labels.write_parquet(LABELS)
+    coverage.write_parquet(COVERAGE)
+    shutil.copyfile(marks_file, MARKS)
+    if years is None:
+        write_outputs()
+    else:
+        update_outputs(buckets, years)
+
+
+# the outputs: long format facts and the companies they are joined with
+SHEETS = 'sheets.parquet'
+SHEETS_IPC = 'sheets.arrow'
+COMPANIES = 'companies.parquet'
+
+
+def write_outputs(years=None, threashold=0.95, engine='pandas'):
+    """ sheets.parquet, sheets/, wide/, distributions.parquet, companies.parquet and metadata.parquet from the cleaned data and its coverage counts
+
+    Only the common concepts are read. With `years`, only those partitions of sheets/ and wide/ are rewritten.
+    The polars engine writes the same files without a pandas copy of the data.
+    """
+    sparsity = coverage_sparsity(pl.read_parquet(COVERAGE))
+    common_concepts = pa.array(sparsity.index[sparsity < threashold], pa.string())
+    if engine == 'polars':
+        return write_outputs_polars(common_concepts, sparsity, years, threashold)
+
+    data = read_cleaned(filter=pc.field('concept').isin(common_concepts))
+    data = data.sort_values(['concept', 'cik', 'fiscal_year'], ignore_index=True)
+    data, metadata = concept_filtering(data, threashold, sparsity)
+
+    write_sheets(sheets_table(data), company_table(data), years)
     metadata.to_parquet('metadata.parquet', index=False)
+
+
+def write_outputs_polars(common_concepts, sparsity, years=None, threashold=0.95):
+    """ write_outputs with the cleaned data read, labelled and sorted by the polars streaming engine """
+    data = (
+        concept_labels_lazy(scan_cleaned().filter(pl.col('concept').is_in(common_concepts.to_pylist())))
+        .sort(['concept', 'cik', 'fiscal_year'])
+        .collect(engine='streaming')
+    )
+    companies = data.select('cik', 'company', 'tickers').unique('cik', keep='first', maintain_order=True).sort('cik')
+    concept_labels = data.select('concept', 'label', 'statement_type').unique(maintain_order=True).to_pandas()
+    # large strings, as pandas writes them
+    sheets = data.drop('company', 'tickers').to_arrow(compat_level=pl.CompatLevel.oldest())
+    del data
+
+    write_sheets(compact_integers(sheets), compact_integers(companies.to_arrow(compat_level=pl.CompatLevel.oldest())), years)
+    concept_metadata(concept_labels, sparsity, threashold).to_parquet('metadata.parquet', index=False)
+
+
+def update_outputs(buckets, years, threashold=0.95):
+    """ write_outputs after a change to `buckets` that kept the common concepts
+
+    The rows of those buckets are swapped in sheets.parquet, read as arrow, so
+    only the changed companies go through pandas; sheets/ and wide/ are
+    rewritten for `years`.
+    """
+    sparsity = coverage_sparsity(pl.read_parquet(COVERAGE))
+    sheets = pq.read_table(SHEETS)
+    companies = pq.read_table(COMPANIES)
+    schema = sheets.schema
+    tables = [sheets.filter(pa.array(~np.isin(sheets['cik'].to_numpy() % BUCKETS, buckets)))]
+    company_tables = [companies.filter(pa.array(~np.isin(companies['cik'].to_numpy() % BUCKETS, buckets)))]
+    del sheets
+
+    if cleaned_files(buckets=buckets):
+        common_concepts = pa.array(sparsity.index[sparsity < threashold], pa.string())
+        data = read_cleaned(buckets=buckets, filter=pc.field('concept').isin(common_concepts))
+        data, _ = concept_filtering(data, threashold, sparsity)
+        table = sheets_table(data)
+        if set(table.column_names) != set(schema.names):
+            print('the columns changed: rewriting everything')
+            return write_outputs(threashold=threashold)
+        tables.append(table.select(schema.names).cast(schema))
+        company_tables.append(company_table(data).cast(companies.schema))
+
+    sheets = pa.concat_tables(tables)
+    del tables
+    sheets = sheets.sort_by([('concept', 'ascending'), ('cik', 'ascending'), ('fiscal_year', 'ascending')])
+    companies = pa.concat_tables(company_tables).sort_by('cik')
+    write_sheets(sheets, companies, years)
+
+    concept_labels = pl.from_arrow(sheets.select(['concept', 'label', 'statement_type'])).unique(maintain_order=True)
+    concept_metadata(concept_labels.to_pandas(), sparsity, threashold).to_parquet('metadata.parquet', index=False)
+
+
+def write_sheets(sheets, companies, years=None):
+    """ sheets.parquet (and sheets.arrow) with its companies.parquet dimension, then sheets/, wide/ and distributions.parquet """
+    pq.write_table(sheets, SHEETS)
+    write_sheets_ipc(sheets)
+    pq.write_table(companies, COMPANIES)
+    write_sheets_dataset(sheets, years=years)
+    write_wide_tables(sheets, years=years)
+    write_distributions(sheets)
+
+
+def write_sheets_ipc(sheets, path=SHEETS_IPC):
+    """ sheets as an uncompressed Arrow IPC file, that the app memory-maps instead of decoding parquet
+
+    Written by polars, so its strings are views polars maps without a copy.
+    The file is swapped in by rename: sessions still mapping the old one keep reading it.
+    """
+    tmp_path = f'{path}.tmp'
+    pl.from_arrow(sheets).write_ipc(tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Clean fetched.parquet into sheets.parquet and metadata.parquet')
+    parser.add_argument('--engine', choices=['pandas', 'polars'], default='pandas',
+                        help='polars runs basic_cleaning out of core, for datasets larger than memory, '
+                             'and writes the outputs without a pandas copy of the data')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only clean again the companies whose fetched data changed since the last run')
+    args = parser.parse_args()
+
+    if args.incremental:
+        incremental_postprocess()
+    else:
+        postprocess(engine=args.engine)
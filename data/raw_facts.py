@@ -0,0 +1,93 @@
+# raw layer: the untouched 10-K facts of every fetched company, so cleaning can be re-run offline
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+RAW_FACTS = Path(__file__).resolve().parent / 'raw_facts'
+BUCKETS = 64
+
+
+def bucket(cik):
+    return int(cik) % BUCKETS
+
+
+def bucket_dir(directory, n):
+    return Path(directory) / f'bucket={n:02d}'
+
+
+class RawFactsWriter:
+    """Buffers companies' facts and writes them as zstd parquet, one file per CIK bucket per flush
+
+    Files are named by write time, so a company fetched again is superseded by
+    its newer copy (see `read_bucket`). Thread-safe; every process writes its
+    own files, so any number of fetch processes can share a directory.
+    """
+    def __init__(self, directory=RAW_FACTS):
+        self.directory = Path(directory)
+        self.lock = threading.Lock()
+        self.companies = {}
+
+    def add(self, cik, tenk, tickers, company):
+        """Record a company's 10-K facts as returned by edgar, along with what fetch_company adds"""
+        raw = tenk.assign(cik=cik, tickers=tickers, company=company)
+        with self.lock:
+            self.companies[cik] = raw
+
+    def flush(self):
+        with self.lock:
+            companies, self.companies = self.companies, {}
+        if not companies:
+            return
+
+        by_bucket = {}
+        for cik, raw in companies.items():
+            by_bucket.setdefault(bucket(cik), []).append(raw)
+
+        name = f'part-{time.time_ns():020d}-{socket.gethostname()}-{os.getpid()}.parquet'
+        for n, frames in by_bucket.items():
+            directory = bucket_dir(self.directory, n)
+            directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = directory / (name + '.tmp')
+            pd.concat(frames).to_parquet(tmp_path, index=False, compression='zstd')
+            os.replace(tmp_path, directory / name)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_bucket(directory, n):
+    """Facts of every company in bucket `n`, each from the last file it was written to"""
+    files = sorted(bucket_dir(directory, n).glob('part-*.parquet'))
+    if not files:
+        return None
+
+    schema = pa.unify_schemas([pq.read_schema(f).remove_metadata() for f in files],
+                              promote_options='permissive')
+    tables = [ds.dataset(f, schema=schema, format='parquet').to_table() for f in files]
+
+    # newest file first, then keep each CIK's rows from the first file it appears in
+    latest = {}
+    for i, table in reversed(list(enumerate(tables))):
+        for cik in table['cik'].unique().to_pylist():
+            latest.setdefault(cik, i)
+
+    frames = []
+    for i, table in enumerate(tables):
+        ciks = [cik for cik, j in latest.items() if j == i]
+        if ciks:
+            frames.append(table.filter(pc.field('cik').isin(ciks)))
+    return pa.concat_tables(frames).to_pandas()
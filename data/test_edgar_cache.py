@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+
+import pytest
+
+import edgar_cache
+from edgar_cache import EdgarCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ edgar_cache's time.time, moved on by hand """
+    now = [1000.0]
+    monkeypatch.setattr(edgar_cache.time, 'time', lambda: now[0])
+    return now
+
+
+class CountingFetch:
+    """ stands in for an EDGAR request """
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_hit_and_miss(tmp_path):
+    cache = EdgarCache(tmp_path)
+    fetch = CountingFetch({'facts': [1, 2, 3]})
+    assert cache.get_or_fetch('get_facts:1', fetch) == {'facts': [1, 2, 3]}
+    assert cache.get_or_fetch('get_facts:1', fetch) == {'facts': [1, 2, 3]}
+    assert fetch.calls == 1
+    assert (cache.stats['hits'], cache.stats['misses']) == (1, 1)
+
+    # edgar's None is not cached: the data may appear later
+    missing = CountingFetch(None)
+    cache.get_or_fetch('get_facts:2', missing)
+    cache.get_or_fetch('get_facts:2', missing)
+    assert missing.calls == 2
+
+
+def test_company_helpers(tmp_path, stub_company):
+    cache = EdgarCache(tmp_path)
+    company = stub_company(7)
+    assert edgar_cache.company_name(company, cache) == 'Company 7'
+    facts = edgar_cache.get_facts(company, cache)
+    assert edgar_cache.get_facts(company, cache).df.equals(facts.df)
+    assert cache.stats['hits'] == 1
+
+
+def test_ttl_expiry(tmp_path, clock):
+    cache = EdgarCache(tmp_path)
+    fetch = CountingFetch('name')
+    cache.get_or_fetch('company_name:1', fetch, ttl=60)
+    clock[0] += 59
+    cache.get_or_fetch('company_name:1', fetch, ttl=60)
+    assert fetch.calls == 1
+    clock[0] += 2
+    cache.get_or_fetch('company_name:1', fetch, ttl=60)
+    assert fetch.calls == 2
+
+    # never expires without a ttl
+    cache.put('xbrl:1', 'xbrl')
+    clock[0] += 10**9
+    assert cache.get('xbrl:1') == 'xbrl'
+
+
+def test_lru_eviction_under_budget(tmp_path, clock):
+    cache = EdgarCache(tmp_path, max_bytes=10**9)
+    for i in range(10):
+        clock[0] += 1
+        cache.put(f'xbrl:{i}', os.urandom(1000))
+    clock[0] += 1
+    cache.get('xbrl:0')
+
+    cache.max_bytes = cache.size() - 1
+    cache.evict()
+    assert cache.size() <= cache.max_bytes * edgar_cache.EVICT_TO
+    assert cache.total == cache.size()
+    kept = {key for key, in cache.db.execute('SELECT key FROM entries')}
+    assert 'xbrl:0' in kept and 'xbrl:9' in kept
+    assert 'xbrl:1' not in kept
+
+
+def test_eviction_counts_shared_blobs_once(tmp_path, clock):
+    cache = EdgarCache(tmp_path, max_bytes=10**9)
+    shared = os.urandom(5000)
+    for i in range(10):
+        clock[0] += 1
+        cache.put(f'find:{i}', shared)
+    for i in range(10):
+        clock[0] += 1
+        cache.put(f'xbrl:{i}', os.urandom(5000))
+
+    cache.max_bytes = cache.size() - 1
+    cache.evict()
+    # the ten entries sharing a blob free it once, all ten go before it is enough
+    assert cache.total == cache.size() <= cache.max_bytes * edgar_cache.EVICT_TO
+    assert cache.db.execute("SELECT COUNT(*) FROM entries WHERE key LIKE 'find:%'").fetchone()[0] == 0
+
+
+def fill(directory, start):
+    cache = EdgarCache(directory)
+    for i in range(start, start + 20):
+        cache.get_or_fetch(f'get_facts:{i}', CountingFetch(list(range(i))))
+
+
+def test_shared_between_processes(tmp_path):
+    processes = [multiprocessing.Process(target=fill, args=(tmp_path, start)) for start in (0, 10)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    cache = EdgarCache(tmp_path)
+    for i in range(30):
+        fetch = CountingFetch(None)
+        assert cache.get_or_fetch(f'get_facts:{i}', fetch) == list(range(i))
+        assert fetch.calls == 0
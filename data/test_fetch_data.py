@@ -0,0 +1,190 @@
+import time
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pytest
+
+import fetch_data
+import ticker_index
+from fetch_data import (RateLimiter, call_with_backoff, clean_and_dedup_data, clean_and_dedup_polars,
+                        company_datapoints, rebuild_bucket, rebuild_datapoints, selected_datapoints)
+from raw_facts import BUCKETS, RawFactsWriter, read_bucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ fetch_data's time.monotonic, which its time.sleep moves on """
+    now = [0.0]
+    monkeypatch.setattr(fetch_data.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(fetch_data.time, 'sleep', lambda seconds: now.__setitem__(0, now[0] + seconds))
+    return now
+
+
+def test_rate_limiter_spaces_requests(clock):
+    limiter = RateLimiter(rate=10)
+    for _ in range(10):
+        limiter.acquire()
+    assert clock[0] == 0  # a full bucket: the first `capacity` requests go at once
+    for _ in range(20):
+        limiter.acquire()
+    assert clock[0] == pytest.approx(2.0)
+
+
+def test_rate_limiter_backs_off_and_recovers(clock):
+    limiter = RateLimiter(rate=10)
+    limiter.back_off(3.0)
+    assert limiter.rate == 5
+    limiter.acquire()
+    assert clock[0] == pytest.approx(3.0 + 1 / 5)  # paused, then an empty bucket at the halved rate
+    for _ in range(100):
+        limiter.recover()
+    assert limiter.rate == 10
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+
+
+class Flaky:
+    """ raises the given errors, then returns 'ok' """
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.acquired = 0
+        self.delays = []
+
+    def acquire(self):
+        self.acquired += 1
+
+    def back_off(self, delay):
+        self.delays.append(delay)
+
+    def recover(self):
+        pass
+
+
+@pytest.mark.parametrize('status', [429, 500, 502, 503, 504])
+def test_backoff_retries_throttling_and_server_errors(status):
+    limiter = RecordingLimiter()
+    fn = Flaky(HTTPError(status), HTTPError(status), HTTPError(status))
+    assert call_with_backoff(fn, limiter, base_delay=1.0) == 'ok'
+    assert fn.calls == limiter.acquired == 4
+    assert limiter.delays == [1.0, 2.0, 4.0]
+
+
+def test_backoff_gives_up():
+    limiter = RecordingLimiter()
+    fn = Flaky(*[HTTPError(503)] * 4)
+    with pytest.raises(HTTPError):
+        call_with_backoff(fn, limiter, retries=3)
+    assert fn.calls == 4 and len(limiter.delays) == 3
+
+
+def test_backoff_raises_other_errors_at_once():
+    class Response:
+        status_code = 404
+
+    error = Exception('not found')
+    error.response = Response()
+    limiter = RecordingLimiter()
+    fn = Flaky(error)
+    with pytest.raises(Exception, match='not found'):
+        call_with_backoff(fn, limiter)
+    assert fn.calls == 1 and limiter.delays == []
+
+
+@pytest.fixture
+def universe(monkeypatch, tmp_path):
+    """ edgar's ticker table for 40 companies, some with two tickers """
+    tickers = pd.DataFrame({'cik': np.r_[np.arange(40), [3, 17]], 'ticker': [f'T{i}' for i in range(42)]})
+    monkeypatch.setattr(fetch_data.reference.tickers, 'get_cik_tickers', lambda: tickers)
+    monkeypatch.setattr(fetch_data, 'build_ticker_index',
+                        lambda refs: ticker_index.build_ticker_index(refs, path=tmp_path / 'ticker_index.parquet'))
+    return list(range(40))
+
+
+def test_parallel_fetch_matches_serial(universe, stub_company, tmp_path):
+    class Uneven(stub_company):
+        """ later companies answer sooner, so the workers finish out of order """
+        @property
+        def latency(self):
+            return (40 - self.cik) * 0.001
+
+    limiter = RateLimiter(rate=10**6)
+    selected_datapoints(tmp_path / 'serial.parquet', workers=1, company_cls=Uneven, limiter=limiter, raw_dir=None)
+    selected_datapoints(tmp_path / 'parallel.parquet', workers=4, company_cls=Uneven, limiter=limiter, raw_dir=None)
+
+    assert (tmp_path / 'parallel.parquet').read_bytes() == (tmp_path / 'serial.parquet').read_bytes()
+    assert (tmp_path / 'parallel.marks.parquet').read_bytes() == (tmp_path / 'serial.marks.parquet').read_bytes()
+    ciks = pd.read_parquet(tmp_path / 'parallel.parquet')['cik']
+    assert ciks.unique().tolist() == universe
+    assert pd.read_parquet(tmp_path / 'parallel.parquet').query('cik == 3')['tickers'].iat[0] == 'T3,T40'
+
+
+def assert_same_rows(actual, expected):
+    """ same columns, values and order once written out; pandas picks period_end's unit from its input, polars has us """
+    expected = pa.Table.from_pandas(expected, preserve_index=False).to_pandas()
+    pd.testing.assert_frame_equal(actual[expected.columns], expected, check_dtype=False)
+    assert {c for c in expected if actual[c].dtype != expected[c].dtype} <= {'period_end'}
+
+
+def test_polars_dedup_matches_per_company(tenk):
+    companies = pd.concat([tenk(n=500, seed=cik).assign(cik=cik) for cik in range(8)])
+    expected = pd.concat([clean_and_dedup_data(frame.copy()) for _, frame in companies.groupby('cik')])
+    assert_same_rows(clean_and_dedup_polars(pl.from_arrow(pa.Table.from_pandas(companies))).to_arrow().to_pandas(), expected)
+
+
+def write_raw_facts(directory, tenk, ciks):
+    with RawFactsWriter(directory) as raw_facts:
+        for cik in ciks:
+            raw_facts.add(cik, tenk(n=400, seed=cik), f'T{cik}', f'Company {cik}')
+
+
+def test_rebuild_bucket_matches_per_company(tenk, tmp_path):
+    with RawFactsWriter(tmp_path / 'raw') as raw_facts:
+        for cik in range(0, 12 * BUCKETS, BUCKETS):
+            facts = tenk(n=400, seed=cik)
+            if cik == BUCKETS:
+                # no balance sheet rows: an empty subset
+                facts = facts[facts['statement_type'] != 'BalanceSheet']
+            raw_facts.add(cik, facts, f'T{cik}', f'Company {cik}')
+
+    rebuild_bucket(tmp_path / 'raw', 0, tmp_path / 'bucket.parquet')
+
+    raw = read_bucket(tmp_path / 'raw', 0)
+    expected = pd.concat([
+        company_datapoints(facts.drop(columns=['cik', 'tickers', 'company']).reset_index(drop=True),
+                           cik, facts['tickers'].iat[0], facts['company'].iat[0])
+        for cik, facts in raw.groupby('cik', sort=False)
+    ])
+    assert expected['accession'].isna().all()
+    assert_same_rows(pd.read_parquet(tmp_path / 'bucket.parquet'), expected)
+
+
+def test_rebuild_ignores_a_crashed_run(tenk, tmp_path):
+    write_raw_facts(tmp_path / 'raw', tenk, [1, 2])
+    rebuild_datapoints(tmp_path / 'fetched.parquet', raw_dir=tmp_path / 'raw', processes=1, ciks=[1, 2, 3])
+    expected = pd.read_parquet(tmp_path / 'fetched.parquet')
+
+    # a bucket file from a run that died, for a bucket without raw facts now
+    parts_dir = tmp_path / 'fetched.rebuild'
+    parts_dir.mkdir()
+    expected[expected['cik'] == 1].assign(cik=3).to_parquet(parts_dir / 'bucket-03.parquet')
+
+    rebuild_datapoints(tmp_path / 'fetched.parquet', raw_dir=tmp_path / 'raw', processes=1, ciks=[1, 2, 3])
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / 'fetched.parquet'), expected)
+    assert not parts_dir.exists()
@@ -0,0 +1,76 @@
+import pytest
+
+import job_queue
+from job_queue import PENDING, RUNNING, JobQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ job_queue's time.time, moved on by hand """
+    now = [1000.0]
+    monkeypatch.setattr(job_queue.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(tmp_path / 'jobs.sqlite', lease_seconds=60, max_attempts=3, backoff_seconds=10)
+    queue.enqueue([11, 12, 13])
+    return queue
+
+
+def state(queue, cik):
+    return queue.db.execute('SELECT state, attempts, not_before FROM jobs WHERE cik = ?', (cik,)).fetchone()
+
+
+def test_lease_in_queue_order(queue, clock):
+    assert queue.lease('a', 2) == [11, 12]
+    assert queue.lease('b', 2) == [13]
+    assert queue.lease('b', 2) == []
+    queue.complete([11, 12], 'a')
+    queue.complete([13], 'b')
+    assert queue.is_drained()
+    assert queue.done_by() == {11: 'a', 12: 'a', 13: 'b'}
+
+
+def test_fail_backs_off_then_dead_letters(queue, clock):
+    queue.complete(queue.lease('a', 3)[1:], 'a')
+    for attempt in range(1, 4):
+        queue.fail(11, 'a', 'ValueError: boom')
+        if attempt < 3:
+            assert state(queue, 11) == (PENDING, attempt, clock[0] + 10 * 2 ** (attempt - 1))
+            assert queue.lease('a', 1) == []
+            clock[0] += 10 * 2 ** (attempt - 1)
+            assert queue.lease('a', 1) == [11]
+    assert queue.dead_letters() == [(11, 3, 'ValueError: boom')]
+    assert queue.is_drained()
+
+
+def test_crashed_worker(queue, clock):
+    """ a worker that dies holding a job: its lease runs out, and the job is retried, then dead-lettered """
+    queue.complete(queue.lease('crashing', 3)[1:], 'crashing')
+    for attempt in range(1, 4):
+        assert state(queue, 11)[:2] == (RUNNING, attempt)
+        clock[0] += 61
+        # the expired lease counts as a failed attempt, and backs off like one
+        assert queue.lease('b', 1) == []
+        if attempt < 3:
+            assert state(queue, 11) == (PENDING, attempt, clock[0] + 10 * 2 ** (attempt - 1))
+            assert not queue.is_drained()
+            clock[0] += 10 * 2 ** (attempt - 1)
+            assert queue.lease('crashing', 1) == [11]
+
+    assert queue.dead_letters() == [(11, 3, 'lease of crashing expired')]
+    assert queue.is_drained()
+
+
+def test_late_complete_after_expiry_is_ignored(queue, clock):
+    assert queue.lease('slow', 1) == [11]
+    clock[0] += 61
+    assert queue.lease('other', 1) == [12]
+    queue.complete([11], 'slow')
+    assert state(queue, 11)[0] == PENDING
+    clock[0] += 10
+    assert queue.lease('other', 1) == [11]
+    queue.complete([11], 'other')
+    assert queue.done_by() == {11: 'other'}
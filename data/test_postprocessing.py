@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pytest
+
+import postprocessing
+from postprocessing import basic_cleaning, basic_cleaning_lazy, basic_cleaning_parquet, relabeling, srt_relabeling
+
+
+def loop_basic_cleaning(df):
+    """ basic_cleaning as it was before the vectorized relabel, one .loc assignment per renamed concept """
+    df['fiscal_year'] = df['fiscal_year'].astype(int)
+    df['period_start'] = pd.to_datetime(df['period_start'], unit='s').astype('datetime64[ms]')
+    df['period_end'] = pd.to_datetime(df['period_end'], unit='s').astype('datetime64[ms]')
+
+    concepts_by_label = df.groupby('label')['concept']
+    for concepts in concepts_by_label.unique()[(concepts_by_label.nunique() > 1)]:
+        if len(concepts) == 2:
+            for old_name in concepts:
+                prefix, name = old_name.split(':')
+                if prefix == 'srt':
+                    df.loc[df['concept'] == old_name, 'concept'] = 'us-gaap:' + name
+
+    df = df.drop_duplicates(subset=['concept', 'fiscal_year', 'cik', 'value'], keep='first')
+    df_sorted = df.sort_values(by=['concept', 'cik', 'fiscal_year', 'period_end'])
+    return df_sorted.drop_duplicates(subset=['concept', 'fiscal_year', 'cik'], keep='last')
+
+
+@pytest.fixture
+def overlapping(fetched):
+    """ fetched rows where many labels are shared by srt and us-gaap concepts
+
+    Also: labels of three concepts, srt concepts alone under their label, and
+    missing concepts and labels, some under a label otherwise held by one srt concept.
+    """
+    df = fetched(n=30_000, concepts=200, ciks=150)
+    rng = np.random.default_rng(1)
+    name = df['concept'].str.split(':').str[1]
+    number = name.str.removeprefix('Concept').astype(int)
+    df.loc[number % 10 == 1, 'concept'] = 'srt:' + name
+    df.loc[(number % 10 == 2) & (rng.random(len(df)) < 0.5), 'concept'] = 'ifrs:' + name
+    df.loc[number % 10 == 3, 'label'] = 'Label shared'
+    missing = rng.random(len(df)) < 0.2
+    df.loc[missing & np.isin(number % 20, [5, 8, 11]), 'concept'] = None
+    df.loc[missing & (number % 20 == 12), 'label'] = None
+    return df
+
+
+def test_relabel_matches_the_loop(overlapping):
+    relabel = relabeling(overlapping)
+    assert len(relabel) > 20
+    assert srt_relabeling(pl.from_pandas(overlapping).lazy()) == relabel
+
+    cleaned = basic_cleaning(overlapping.copy())
+    expected = loop_basic_cleaning(overlapping.copy())
+    assert cleaned['concept'].isna().any()
+    pd.testing.assert_frame_equal(cleaned, expected, check_dtype=False)
+
+
+def test_lazy_matches_pandas(overlapping):
+    cleaned = basic_cleaning(overlapping.copy()).reset_index(drop=True)
+    lazy = basic_cleaning_lazy(pl.from_pandas(overlapping).lazy()).collect().to_pandas()
+    pd.testing.assert_frame_equal(lazy, cleaned, check_dtype=False)
+
+
+def test_parquet_matches_pandas(overlapping, tmp_path):
+    overlapping.to_parquet(tmp_path / 'fetched.parquet')
+    basic_cleaning_parquet(tmp_path / 'fetched.parquet', tmp_path / 'cleaned.parquet', partitions=3)
+    cleaned = basic_cleaning(overlapping.copy()).reset_index(drop=True)
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / 'cleaned.parquet'), cleaned, check_dtype=False)
+
+
+def test_polars_outputs_match_pandas(fetched, tmp_path, monkeypatch):
+    outputs = {}
+    for engine in ['pandas', 'polars']:
+        (tmp_path / engine).mkdir()
+        monkeypatch.chdir(tmp_path / engine)
+        data = fetched(n=20_000, concepts=30, ciks=200)
+        # unlabelled concepts get a label from their name
+        data.loc[data['concept'] == 'us-gaap:Concept3', 'label'] = ''
+        data.to_parquet('fetched.parquet')
+        postprocessing.postprocess(engine=engine)
+        outputs[engine] = {
+            path: pl.read_ipc(path) if path.suffix == '.arrow' else pl.read_parquet(path)
+            for path in sorted(Path('.').glob('*.*')) + sorted(Path('sheets').rglob('*.parquet'))
+            + sorted(Path('wide').glob('*.parquet'))
+            if path.name != 'fetched.parquet'
+        }
+
+    assert outputs['pandas'].keys() == outputs['polars'].keys()
+    for path, frame in outputs['pandas'].items():
+        assert outputs['polars'][path].equals(frame), path
@@ -0,0 +1,35 @@
+# CIK <-> ticker lookups, built once from edgar's ticker reference table
+from pathlib import Path
+
+import pandas as pd
+
+TICKER_INDEX = Path(__file__).resolve().parent / 'ticker_index.parquet'
+
+
+def build_ticker_index(ticker_cik_refs, path=TICKER_INDEX):
+    """Group the reference table into one row per CIK with its list of tickers
+
+    Rows and tickers keep the reference table order. Written to `path` so the
+    pipeline, make_json.py and the app can load it instead of scanning the table.
+    """
+    index = (
+        ticker_cik_refs[['cik', 'ticker']]
+        .astype({'cik': 'int64'})
+        .groupby('cik', sort=False)['ticker']
+        .agg(list)
+        .rename('tickers')
+        .reset_index()
+    )
+    if path is not None:
+        index.to_parquet(path, index=False)
+    return index
+
+
+def load_ticker_index(path=TICKER_INDEX):
+    return pd.read_parquet(path)
+
+
+def tickers_by_cik(index):
+    """CIK -> comma-joined tickers, as stored in the `tickers` column of the datasets"""
+    return dict(zip(index['cik'], (','.join(tickers) for tickers in index['tickers'])))
+